@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+import os
+import json
+import time
+import sqlite3
+import collections
+
+class AnnotationCache:
+    '''
+    This class keeps the downloaded ChEBI ID's of publications in a SQLite file, so that publications shared by several queries are downloaded only once.
+    Publications are stored with "source:extId" as key, also when they have no annotations of type 'Chemicals' (an empty list).
+    Hits and misses are counted, so that the hit rate can be reported at the end of a search. The hits and misses of one query are also recorded in its harvest stats.
+    An offline cache holds the annotations of a bulk dump (see ingest_annotations.py): publications that are not in it are taken to have no chemicals, instead of being downloaded.
+    '''
+
+    def __init__(self, file, max_age=None, max_entries=None, offline=False):
+        '''
+        This function opens (or creates) the cache file and evicts entries older than 'max_age' days and, if there are more than 'max_entries' entries, the least recently used ones.
+        '''
+        folder = os.path.dirname(file)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        self.connection = sqlite3.connect(file)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS annotations (article TEXT PRIMARY KEY, chebi_ids TEXT, stored REAL, used REAL)')
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.offline = offline
+        self.evict(max_age, max_entries)
+
+    def evict(self, max_age=None, max_entries=None):
+        '''
+        This function removes entries that were downloaded more than 'max_age' days ago, and the least recently used entries above 'max_entries'.
+        It returns the number of removed entries.
+        '''
+        removed = 0
+        if max_age != None:
+            cursor = self.connection.execute('DELETE FROM annotations WHERE stored < ?', (time.time() - max_age*24*60*60,))
+            removed += cursor.rowcount
+        if max_entries != None:
+            cursor = self.connection.execute('DELETE FROM annotations WHERE article NOT IN (SELECT article FROM annotations ORDER BY used DESC LIMIT ?)', (max_entries,))
+            removed += cursor.rowcount
+        self.connection.commit()
+        return removed
+
+    def lookup(self, publications, stats=None):
+        '''
+        This function recieves a list of (publication ID, source) tuples and looks them up in the cache, and records the hits and misses in the harvest stats if given.
+        It returns a dictionary with the ChEBI ID's of the cached publications (publication ID as key, like 'get_annotations'), and a list of the publications that are not cached.
+        An offline cache returns an empty list instead, so that nothing is downloaded.
+        '''
+        cached = dict()
+        missing = []
+        found = []
+        for publication in publications:
+            key = article_key(publication)
+            row = self.connection.execute('SELECT chebi_ids FROM annotations WHERE article = ?', (key,)).fetchone()
+            if row == None:
+                missing.append(publication)
+            else:
+                found.append((time.time(), key))
+                chebi_ids = json.loads(row[0])
+                if len(chebi_ids) > 0:
+                    cached[publication[0]] = chebi_ids
+
+        self.connection.executemany('UPDATE annotations SET used = ? WHERE article = ?', found)
+        self.connection.commit()
+        self.hits += len(found)
+        self.misses += len(missing)
+        if stats != None:
+            stats.cache(len(found), len(missing), self.offline)
+        if self.offline:
+            return cached, []
+        return cached, missing
+
+    def store(self, publications, dict):
+        '''
+        This function stores the downloaded ChEBI ID's of the publications. Publications that are not in the dictionary are stored with an empty list.
+        '''
+        now = time.time()
+        rows = [(article_key(publication), json.dumps(dict.get(publication[0], [])), now, now) for publication in publications]
+        self.connection.executemany('INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)', rows)
+        self.connection.commit()
+
+    def merge(self, articles):
+        '''
+        This function recieves a list of ((publication ID, source), ChEBI ID's) tuples and adds the ChEBI ID's to the ones already stored, instead of replacing them like 'store'.
+        An article can then be spread over several lines or dump files: a line without chemicals keeps the chemicals of an earlier line, and an article that is read twice is not counted twice.
+        '''
+        now = time.time()
+        merged = dict()
+        for publication, chebi_ids in articles:
+            key = article_key(publication)
+            if key not in merged:
+                row = self.connection.execute('SELECT chebi_ids FROM annotations WHERE article = ?', (key,)).fetchone()
+                merged[key] = json.loads(row[0]) if row != None else []
+            merged[key] = union_mentions(merged[key], chebi_ids)
+        rows = [(key, json.dumps(chebi_ids), now, now) for key, chebi_ids in merged.items()]
+        self.connection.executemany('INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)', rows)
+        self.connection.commit()
+
+    def report(self):
+        '''
+        This function returns a line with the number of cache hits and misses and the hit rate, and resets the counters for the next search.
+        '''
+        report = cache_report(self.hits, self.misses, self.offline)
+        self.hits = 0
+        self.misses = 0
+        return report
+
+    def close(self):
+        self.connection.close()
+
+def cache_report(hits, misses, offline=False):
+    '''
+    This function returns a line with the number of cache hits and misses and the hit rate (for an offline cache: the publications found in the store).
+    '''
+    total = hits + misses
+    rate = 100 * hits / total if total > 0 else 0
+    if offline:
+        return 'annotation store: %d publications found, %d not in the store (%.1f%% found)' % (hits, misses, rate)
+    return 'annotation cache: %d hits, %d misses (hit rate %.1f%%)' % (hits, misses, rate)
+
+def union_mentions(chebi_ids, new_ids):
+    '''
+    This function returns the union of two lists of ChEBI ID's with one entry per mention: every ChEBI ID is kept as often as it is in the list that mentions it most.
+    '''
+    counts = collections.Counter(chebi_ids)
+    union = list(chebi_ids)
+    for chebi_id, number in collections.Counter(new_ids).items():
+        union.extend([chebi_id] * max(0, number - counts[chebi_id]))
+    return union
+
+def article_key(publication):
+    '''
+    This function returns the cache key of a (publication ID, source) tuple: "source:extId", like in the annotations api.
+    '''
+    return str(publication[1]) + ':' + str(publication[0])
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+import search_query
+import http_client
+from mock_europepmc import MockEuropePMC, synthetic_corpus
+
+# Number of date-range shards that are harvested at the same time in 'sharded' mode
+SHARDS = 4
+
+def run_harvest(mode, pageSize, connections, batch_size, shard_size):
+    '''
+    This function runs one harvest against the current EUROPE_PMC url with the serial ('serial'), asynchronous ('async') or date-sharded ('sharded') harvester,
+    or with the asynchronous harvester and the text mined terms filter in the query ('filtered').
+    The progress messages of the harvester are hidden. It returns the dictionary of the harvest and the wall time in seconds.
+    '''
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == 'serial':
+            chebi_dict = search_query.search_publications('benchmark', pageSize, batch_size)
+        elif mode == 'filtered':
+            chebi_dict = asyncio.run(search_query.harvest_publications(search_query.filter_query('benchmark'), pageSize, connections, batch_size))
+        elif mode == 'sharded':
+            chebi_dict = asyncio.run(search_query.harvest_shards('benchmark', pageSize, connections, shard_size, SHARDS, batch_size))
+        else:
+            chebi_dict = asyncio.run(search_query.harvest_publications('benchmark', pageSize, connections, batch_size))
+    wall_time = time.perf_counter() - start
+    return chebi_dict, wall_time
+
+def benchmark(sizes, modes, pageSize, connections, batch_size, latency, search_latency, error_rate, shard_size):
+    '''
+    This function harvests a synthetic corpus of every size with every harvester mode from a local mock server, and prints one line per run:
+    the wall time, search pages per second, annotation requests per second and publications per second, the kilobytes of search pages received,
+    and whether the harvest found exactly the chemicals of the corpus.
+    '''
+    print('%8s %8s %6s %10s %8s %14s %16s %10s %8s %8s' % ('size', 'mode', 'batch', 'wall (s)', 'pages/s', 'annotations/s', 'publications/s', 'search kB', 'errors', 'correct'))
+    http_client.get_session(connections + SHARDS)
+
+    for size in sizes:
+        corpus = synthetic_corpus(size)
+        for mode in modes:
+            mock = MockEuropePMC(corpus, latency=latency, jitter=latency, error_rate=error_rate, search_latency=search_latency)
+            search_query.EUROPE_PMC = mock.start()
+
+            chebi_dict, wall_time = run_harvest(mode, pageSize, connections, batch_size, shard_size)
+
+            mock.stop()
+            errors = sum(value for key, value in mock.stats.items() if key.startswith('error'))
+            correct = chebi_dict == mock.expected_results()
+            print('%8d %8s %6d %10.2f %8.2f %14.1f %16.1f %10.1f %8d %8s' % (size, mode, batch_size, wall_time, mock.stats['search'] / wall_time,
+                mock.stats['annotations'] / wall_time, size / wall_time, mock.stats['bytes search'] / 1000, errors, correct))
+
+    print(http_client.stats_report())
+
+def parser():
+    parser = argparse.ArgumentParser(description='This script benchmarks the harvester of search_query.py against a local mock of the Europe PMC api')
+    parser.add_argument('-n', required=False, default='1000,10000,50000', metavar='sizes', dest='sizes', help='[n] to select the corpus sizes (comma-separated), default=1000,10000,50000')
+    parser.add_argument('-m', required=False, default='serial,async', metavar='modes', dest='modes', help='[m] to select the harvester modes (comma-separated: serial, async, sharded, filtered), default=serial,async')
+    parser.add_argument('-p', required=False, type=int, default=1000, metavar='pageSize', dest='pageSize', help='[p] to select pageSize, default=1000')
+    parser.add_argument('-c', required=False, type=int, default=10, metavar='connections', dest='connections', help='[c] to select the number of annotation connections, default=10')
+    parser.add_argument('-b', required=False, type=int, default=1, metavar='batch_size', dest='batch_size', help='[b] to select the number of publications per annotation request, default=1')
+    parser.add_argument('-S', required=False, type=int, default=5000, metavar='shard_size', dest='shard_size', help='[S] to select the maximum number of hits per shard in sharded mode, default=5000')
+    parser.add_argument('-l', required=False, type=float, default=0.02, metavar='latency', dest='latency', help='[l] to select the latency per request in seconds, default=0.02')
+    parser.add_argument('-s', required=False, type=float, default=1, metavar='search_latency', dest='search_latency', help='[s] to select the extra latency of search pages in seconds, default=1')
+    parser.add_argument('-e', required=False, type=float, default=0, metavar='error_rate', dest='error_rate', help='[e] to select the fraction of failing requests, default=0')
+    arguments = parser.parse_args()
+    return arguments
+
+def main():
+    args = parser()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    modes = args.modes.split(',')
+    benchmark(sizes, modes, args.pageSize, args.connections, args.batch_size, args.latency, args.search_latency, args.error_rate, args.shard_size)
+
+if __name__ == '__main__':
+    main()
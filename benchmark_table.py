@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import make_table
+from property_store import compile_store, PropertyStore
+
+def synthetic_properties(folder, size, seed=0):
+    '''
+    This function writes property files like the ones of the files folder for ChEBI ID's 1 up to 'size': Names, Mass, logP and idf as .tsv files and Class as .pkl file.
+    About 5% of the ChEBI ID's have no Mass, 10% have "-" as logP and 5% are left out of the Names file, so that the tables have missing values to leave out.
+    The first 10% of the ChEBI ID's are classes in a random ontology: every class has one or two classes with a lower ChEBI ID above it, and every other ChEBI ID
+    is a chemical of up to three classes.
+    '''
+    rng = random.Random(seed)
+    ids = list(range(1, size + 1))
+
+    def write(name, rows):
+        with open(os.path.join(folder, name), 'w', encoding='utf-8') as f:
+            for id, info in rows:
+                f.write('%d\t%s\n' % (id, info))
+
+    write('ChEBI2Names_bench.tsv', [(id, 'compound %d' % id) for id in ids if rng.random() > 0.05])
+    write('ChEBI2Mass_bench.tsv', [(id, '%.5f' % (rng.random() * 900)) for id in ids if rng.random() > 0.05])
+    write('ChEBI2logP_bench.tsv', [(id, '-' if rng.random() < 0.1 else '%.3g' % (rng.random() * 10 - 3)) for id in ids])
+    write('ChEBI2idf_bench.tsv', [(id, '%.4f' % (rng.random() * 10)) for id in ids])
+    ontology = max(size // 10, 2)
+    classes = [[] if id == 1 else [str(rng.randrange(1, id)) for i in range(1 if rng.random() < 0.8 else 2)] if id <= ontology else
+        [str(rng.randrange(1, ontology + 1)) for i in range(rng.randrange(0, 4))] for id in ids]
+    pd.DataFrame({'ChEBI': [str(id) for id in ids], 'Info': classes}).to_pickle(os.path.join(folder, 'ChEBI2Class_bench.pkl'))
+
+def legacy_import_properties(folder):
+    '''
+    This function reads the property files into nested dictionaries, like make_table.py did before the property store.
+    '''
+    data = dict()
+    for file in os.listdir(folder):
+        path = os.path.join(folder, file)
+        key = file.split('2')[1].split('_')[0]
+        if '.pkl' in file:
+            df = pd.read_pickle(path)
+            df['ChEBI'] = df['ChEBI'].astype(int)
+            df = df.set_index('ChEBI')
+        else:
+            df = pd.read_csv(path, sep='\t', header=None, names=['ChEBI', 'Info'], index_col='ChEBI', dtype={"ChEBI": "int", "Info": "str"})
+        data[key] = df.to_dict()
+    return data
+
+def legacy_make_table(data, df_results):
+    '''
+    This function makes the table with one dictionary lookup per ChEBI ID and property, like make_table.py did before the vectorized join.
+    '''
+    def get_info(key, id):
+        try:
+            return data[key]['Info'][id]
+        except:
+            return float('NaN')
+
+    table = df_results
+    for key in data.keys():
+        table.loc[:,key] = pd.Series([get_info(key, id) for id in df_results.index.to_list()], index=df_results.index)
+    table = table.replace({'Mass': {"-": np.nan}, 'logP': {"-": np.nan}})
+    table = table.dropna()
+    table = table.sort_values(by='Count', ascending=False)
+    return table
+
+def same_table(legacy, table):
+    '''
+    This function tells whether both tables hold the same ChEBI ID's and values. The legacy table keeps Mass, logP and idf as text, so these are compared as numbers.
+    '''
+    if not legacy.index.equals(table.index):
+        return False
+    for column in table.columns:
+        if table[column].dtype == float:
+            if not np.allclose(legacy[column].astype(float), table[column], equal_nan=True):
+                return False
+        elif not legacy[column].equals(table[column]):
+            return False
+    return True
+
+def benchmark(sizes, legacy):
+    '''
+    This function makes tables for synthetic results with every number of unique ChEBI ID's in 'sizes', with the property store and (if 'legacy') the legacy path,
+    and prints the time to load the properties and to make the table.
+    '''
+    universe = int(max(sizes) * 1.2)
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as folder:
+        files_folder = os.path.join(folder, 'files')
+        store_folder = os.path.join(folder, 'properties')
+        os.mkdir(files_folder)
+        print('writing synthetic properties for %d ChEBI ID\'s...' % universe)
+        synthetic_properties(files_folder, universe)
+
+        start = time.perf_counter()
+        compile_store(files_folder, store_folder)
+        print('compiling the property store took %.2f s (once per release of the files)' % (time.perf_counter() - start))
+
+        legacy_data = None
+        if legacy:
+            start = time.perf_counter()
+            legacy_data = legacy_import_properties(files_folder)
+            legacy_load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        data = PropertyStore(store_folder)
+        load = time.perf_counter() - start
+
+        print('%10s %12s %12s %12s %12s %8s %8s' % ('unique IDs', 'legacy load', 'legacy table', 'store load', 'store table', 'speedup', 'same'))
+        for size in sizes:
+            ids = rng.choice(np.arange(1, int(size * 1.1) + 1), size=size, replace=False)
+            df_results = pd.DataFrame({'Count': rng.integers(1, 1000, size=size)}, index=pd.Index(ids, name='ChEBI'))
+
+            start = time.perf_counter()
+            table = make_table.make_table(data, df_results.copy())
+            table_time = time.perf_counter() - start
+
+            if legacy:
+                start = time.perf_counter()
+                legacy_table = legacy_make_table(legacy_data, df_results.copy())
+                legacy_time = time.perf_counter() - start
+                print('%10d %12.3f %12.3f %12.4f %12.3f %8.1f %8s' % (size, legacy_load, legacy_time, load, table_time,
+                    (legacy_load + legacy_time) / (load + table_time), same_table(legacy_table, table)))
+            else:
+                print('%10d %12s %12s %12.4f %12.3f %8s %8s' % (size, '-', '-', load, table_time, '-', '-'))
+
+def parser():
+    parser = argparse.ArgumentParser(description='This script benchmarks make_table.py with the property store against the legacy dictionary lookups, on synthetic properties and results')
+    parser.add_argument('-n', required=False, default='10000,100000,1000000', metavar='sizes', dest='sizes', help='[n] to select the numbers of unique ChEBI ID\'s in the results (comma-separated), default=10000,100000,1000000')
+    parser.add_argument('--no-legacy', default=False, action='store_true', dest='no_legacy', help='[no-legacy] to leave out the legacy path, which needs a lot of memory for large sizes')
+    arguments = parser.parse_args()
+    return arguments
+
+def main():
+    args = parser()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    benchmark(sizes, not args.no_legacy)
+
+if __name__ == '__main__':
+    main()
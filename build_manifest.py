@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+import os
+import json
+import hashlib
+import datetime
+from file_releases import get_repo_to_rel
+from publication_matrix import matrix_file
+
+# Manifest of the tables folder: for every table the inputs and property release it was made from
+MANIFEST_FILE = 'tables/manifest.json'
+
+def file_hash(path):
+    '''
+    This function returns the sha256 hash of the content of a file, read in blocks so that large results files do not have to fit in memory.
+    '''
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def property_release(files_folder):
+    '''
+    This function returns the release of every property file in the files folder (e.g. {"ChEBI2Names": "rel208"}), as download_files.py tracks them.
+    '''
+    if not os.path.isdir(files_folder):
+        return dict()
+    return {file: info['rel'] for file, info in sorted(get_repo_to_rel(files_folder).items())}
+
+class BuildManifest:
+    '''
+    This class keeps the manifest of the tables folder. Every table is recorded with the hash of its results file, the property release and the options of make_table.py
+    (e.g. the class filter) it was made with. A table is up to date when its .pkl file (and the other files of its options, see 'outputs') is there and all three are still the same, so only the stale tables have to be made again.
+    The hash of a results file is only computed again when its size or modification time changed since it was recorded.
+    '''
+
+    def __init__(self, manifest_file=MANIFEST_FILE):
+        self.manifest_file = manifest_file
+        self.tables = dict()
+        self.hashes = dict()
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, 'r') as f:
+                self.tables = json.load(f)
+
+    def input_hash(self, term, input):
+        '''
+        This function returns the hash of the results file of a table, taken from the manifest if the file did not change since the table was made.
+        '''
+        stat = os.stat(input)
+        entry = self.tables.get(term, dict())
+        if entry.get('input') == input and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            return entry['sha256']
+        key = (input, stat.st_size, stat.st_mtime)
+        if key not in self.hashes:
+            self.hashes[key] = file_hash(input)
+        return self.hashes[key]
+
+    def outputs(self, term, options):
+        '''
+        This function returns the files that make_table.py makes for a table with these options: the table itself, and the matrix file with -m.
+        '''
+        files = ['tables/'+term+'_table.pkl']
+        if options.get('matrix'):
+            files.append(matrix_file(term))
+        return files
+
+    def is_up_to_date(self, term, input, release, options):
+        if not all(os.path.isfile(file) for file in self.outputs(term, options)) or term not in self.tables:
+            return False
+        entry = self.tables[term]
+        return entry['sha256'] == self.input_hash(term, input) and entry['release'] == release and entry.get('options') == options
+
+    def record(self, term, input, release, options):
+        '''
+        This function records that the table of 'term' was made from the results file 'input' with the property files of 'release'.
+        '''
+        stat = os.stat(input)
+        self.tables[term] = {'input': input, 'sha256': self.input_hash(term, input), 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'release': release, 'options': options, 'built': datetime.datetime.now().isoformat(timespec='seconds')}
+
+    def save(self):
+        with open(self.manifest_file, 'w') as f:
+            json.dump(self.tables, f, indent=4)
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+
+import os
+import sys
+import argparse
+import itertools
+import numpy as np
+
+# Property with the lists of ChEBI ID's of the higher level classes of every chemical
+CLASS_KEY = 'Class'
+
+def ancestor_closure(offsets, data):
+    '''
+    This function recieves the classes of every ChEBI ID as integer CSR arrays: the classes of ChEBI ID 'id' are data[offsets[id]:offsets[id+1]].
+    It returns the transitive closure in the same form: every class of a chemical, every class of those classes, and so on, sorted and without duplicates.
+    A class is a ChEBI ID itself, so its own classes are found at its position. A cycle in the ontology is broken where it is found.
+    '''
+    size = len(offsets) - 1
+    starts = offsets.tolist()
+    # only the ChEBI ID's with classes need work, the closure of every other ChEBI ID is empty
+    rows = np.flatnonzero(np.diff(offsets)).tolist()
+    closure = dict()
+    empty = np.zeros(0, dtype=np.int32)
+
+    def parents(id):
+        if id >= size:
+            return empty
+        return data[starts[id]:starts[id+1]]
+
+    for root in rows:
+        if root in closure:
+            continue
+        # depth-first, so that the closure of every class is known before the closure of its chemicals is made
+        stack = [root]
+        visiting = set()
+        while stack:
+            id = stack[-1]
+            if id in closure:
+                stack.pop()
+                continue
+            direct = parents(id)
+            if len(direct) == 0:
+                closure[id] = empty
+                stack.pop()
+                continue
+            if id not in visiting:
+                visiting.add(id)
+                pending = [parent for parent in direct.tolist() if parent not in closure and parent not in visiting]
+                if pending:
+                    stack.extend(pending)
+                    continue
+            known = [closure[parent] for parent in direct.tolist() if parent in closure]
+            ancestors = np.unique(np.concatenate([direct] + known))
+            closure[id] = ancestors[ancestors != id].astype(np.int32)
+            visiting.discard(id)
+            stack.pop()
+
+    lengths = np.zeros(size, dtype=np.int64)
+    lengths[rows] = [len(closure[id]) for id in rows]
+    closure_offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(lengths, out=closure_offsets[1:])
+    closure_data = np.concatenate([closure[id] for id in rows]) if rows else empty
+    return closure_offsets, closure_data.astype(np.int32)
+
+def invert(offsets, data, size):
+    '''
+    This function turns the CSR arrays of chemical -> classes around into CSR arrays of class -> chemicals, with the chemicals of every class sorted.
+    '''
+    chemicals = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+    order = np.argsort(data, kind='stable')
+    members_offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(data, minlength=size), out=members_offsets[1:])
+    return members_offsets, chemicals[order]
+
+def build_index(offsets, data):
+    '''
+    This function returns the arrays of the class index for the classes of every ChEBI ID in CSR form (see 'ancestor_closure'):
+        - ancestor_offsets, ancestor_data: all classes of every chemical (the transitive closure)
+        - member_offsets, member_data: all chemicals of every class (the inverted index)
+    '''
+    offsets = np.asarray(offsets, dtype=np.int64)
+    data = np.asarray(data, dtype=np.int32)
+    ancestor_offsets, ancestor_data = ancestor_closure(offsets, data)
+    size = max(len(offsets) - 1, int(ancestor_data.max()) + 1 if len(ancestor_data) > 0 else 0)
+    member_offsets, member_data = invert(ancestor_offsets, ancestor_data, size)
+    return {'ancestor_offsets': ancestor_offsets, 'ancestor_data': ancestor_data, 'member_offsets': member_offsets, 'member_data': member_data}
+
+def index_file(store_folder, name, key=CLASS_KEY):
+    return os.path.join(store_folder, '%s.index.%s.npy' % (key, name))
+
+def write_index(store_folder, offsets, data, key=CLASS_KEY):
+    '''
+    This function builds the class index from the CSR arrays of a list property and writes it to the property store folder, next to the property itself.
+    '''
+    for name, array in build_index(offsets, data).items():
+        np.save(index_file(store_folder, name, key), array)
+
+class ClassIndex:
+    '''
+    This class answers ChEBI class membership queries with the class index. A class is turned into a bitmap over the ChEBI ID's of its chemicals once,
+    after that the membership of any number of ChEBI ID's is a single array lookup instead of a search through the class list of every chemical.
+    '''
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.size = len(arrays['member_offsets']) - 1
+        self.bitmaps = dict()
+
+    @classmethod
+    def load(cls, store_folder, key=CLASS_KEY):
+        '''
+        This function opens the class index of a property store. The arrays are memory-mapped like the property store itself.
+        '''
+        names = ['ancestor_offsets', 'ancestor_data', 'member_offsets', 'member_data']
+        return cls({name: np.asarray(np.load(index_file(store_folder, name, key), mmap_mode='r')) for name in names})
+
+    @classmethod
+    def from_lists(cls, ids, class_lists):
+        '''
+        This function builds a class index in memory from ChEBI ID's and their class lists (e.g. the index and the Class column of a table).
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        class_lists = list(class_lists)
+        # rows in ChEBI ID order, like in the property store
+        order = np.argsort(ids, kind='stable')
+        class_lists = [class_lists[row] for row in order.tolist()]
+        classes = np.array(list(itertools.chain.from_iterable(class_lists)), dtype=np.int64)
+        size = int(max(ids.max() if len(ids) > 0 else 0, classes.max() if len(classes) > 0 else 0)) + 1
+
+        lengths = np.zeros(size, dtype=np.int64)
+        lengths[ids[order]] = [len(id_list) for id_list in class_lists]
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(build_index(offsets, classes))
+
+    def ancestors(self, id):
+        '''
+        This function returns all classes of a ChEBI ID, the classes of those classes included.
+        '''
+        if id < 0 or id >= len(self.arrays['ancestor_offsets']) - 1:
+            return np.zeros(0, dtype=np.int32)
+        offsets = self.arrays['ancestor_offsets']
+        return self.arrays['ancestor_data'][offsets[id]:offsets[id+1]]
+
+    def members(self, class_id):
+        '''
+        This function returns the ChEBI ID's of all chemicals of a class (sorted), also those of its subclasses.
+        '''
+        if class_id < 0 or class_id >= self.size:
+            return np.zeros(0, dtype=np.int32)
+        offsets = self.arrays['member_offsets']
+        return self.arrays['member_data'][offsets[class_id]:offsets[class_id+1]]
+
+    def bitmap(self, class_id):
+        '''
+        This function returns a boolean array with a position for every ChEBI ID, True for the chemicals of the class. The bitmap is kept for the next query.
+        '''
+        if class_id not in self.bitmaps:
+            bitmap = np.zeros(self.size, dtype=bool)
+            bitmap[self.members(class_id)] = True
+            self.bitmaps[class_id] = bitmap
+        return self.bitmaps[class_id]
+
+    def in_class(self, ids, class_id):
+        '''
+        This function returns a boolean array that tells for every ChEBI ID whether it is a chemical of the class.
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        inside = (ids >= 0) & (ids < self.size)
+        found = np.zeros(len(ids), dtype=bool)
+        found[inside] = self.bitmap(int(class_id))[ids[inside]]
+        return found
+
+def parser():
+    parser = argparse.ArgumentParser(description='This script lists the chemicals of a ChEBI class with the class index of the property store')
+    parser.add_argument('-c', required=True, type=int, metavar='class_id', dest='class_id', help='[c] to select the ChEBI ID of the class')
+    parser.add_argument('-s', required=False, default='properties', metavar='store_folder', dest='store_folder', help='[s] to select the property store folder, default=properties')
+    arguments = parser.parse_args()
+    return arguments
+
+def main():
+    args = parser()
+    if not os.path.isfile(index_file(args.store_folder, 'member_offsets')):
+        sys.exit('Error: no class index in %s, run property_store.py first' % args.store_folder)
+    members = ClassIndex.load(args.store_folder).members(args.class_id)
+    print('%d chemicals in class %d' % (len(members), args.class_id))
+    for id in members.tolist():
+        print(id)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+import os
+import sys
+import argparse
+import functools
+import numpy as np
+import pandas as pd
+from pathlib import PurePath
+from compact_results import write_compact
+from search_metadata import read_metadata, write_metadata
+
+# Set operations on sorted arrays of publication numbers, and the operator that combines the queries of the terms in the same way
+OPERATIONS = {'union': np.union1d, 'intersection': np.intersect1d, 'difference': np.setdiff1d}
+QUERY_OPERATORS = {'union': 'OR', 'intersection': 'AND', 'difference': 'AND NOT'}
+
+# Number of rows of a results file that are read at a time
+CHUNK_SIZE = 1000000
+
+def results_path(term):
+    return 'results/'+str(term)+'_ChEBI_IDs.tsv'
+
+def read_chunks(file, chunk_size=CHUNK_SIZE):
+    '''
+    This function returns the chunks of a results file, none for an empty results file (a query without hits).
+    '''
+    try:
+        return pd.read_csv(file, sep='\t', header=None, names=['ChEBI', 'Publication'], dtype={"ChEBI": "int64", "Publication": "str"}, chunksize=chunk_size)
+    except pd.errors.EmptyDataError:
+        return []
+
+def publication_numbers(chunk, pub_to_number):
+    '''
+    This function returns the number of the publication of every row of a chunk. Every publication ID gets a number the first time it is seen,
+    in any of the results files, so that the publications of all files can be compared as integers.
+    '''
+    codes, uniques = pd.factorize(chunk['Publication'])
+    numbers = np.array([pub_to_number.setdefault(pub_id, len(pub_to_number)) for pub_id in uniques], dtype=np.int64)
+    return numbers[codes]
+
+def read_publications(file, pub_to_number):
+    '''
+    This function reads the publications of a results file in chunks, and returns their numbers as a sorted array without duplicates.
+    '''
+    numbers = [np.unique(publication_numbers(chunk, pub_to_number)) for chunk in read_chunks(file)]
+    return functools.reduce(np.union1d, numbers, np.zeros(0, dtype=np.int64))
+
+def combine(publication_sets, operation):
+    '''
+    This function combines the sorted publication arrays of the results files from left to right, e.g. for 'difference' the publications of the first
+    file that are in none of the other files.
+    '''
+    return functools.reduce(OPERATIONS[operation], publication_sets)
+
+def combine_queries(queries, operation):
+    '''
+    This function returns the query that describes the combined results, e.g. "(query A) AND NOT (query B)" for the difference.
+    '''
+    return (' %s ' % QUERY_OPERATORS[operation]).join('(%s)' % query for query in queries)
+
+def write_combined(files, selected, pub_to_number, output):
+    '''
+    This function writes the rows of the selected publications from the results files to the output results file, and returns the number of publications,
+    rows and unique ChEBI ID's. A publication that is in several files is written once, with the rows of the first file it is in.
+    '''
+    todo = np.zeros(len(pub_to_number), dtype=bool)
+    todo[selected] = True
+    rows = 0
+    chemicals = set()
+
+    with open(output, 'w', newline='', encoding="utf-8") as tsvfile:
+        for file in files:
+            done = []
+            for chunk in read_chunks(file):
+                numbers = publication_numbers(chunk, pub_to_number)
+                keep = todo[numbers]
+                chunk[keep].to_csv(tsvfile, sep='\t', header=False, index=False)
+                rows += int(keep.sum())
+                chemicals.update(np.unique(chunk['ChEBI'].to_numpy()[keep]).tolist())
+                done.append(numbers[keep])
+            # the rows of a publication may be spread over chunks, so it is only marked as done after the whole file
+            for numbers in done:
+                todo[numbers] = False
+
+    return len(selected), rows, len(chemicals)
+
+def combine_results(terms, operation, output_term):
+    '''
+    This function makes a new results file with metadata from the results files of the terms, with the publications of the set operation.
+    The query in the metadata combines the queries of the terms, and the search date is the oldest search date of the terms.
+    '''
+    files = [results_path(term) for term in terms]
+    pub_to_number = dict()
+    publication_sets = [read_publications(file, pub_to_number) for file in files]
+    for term, publications in zip(terms, publication_sets):
+        print('%s: %d publications' % (term, len(publications)))
+    selected = combine(publication_sets, operation)
+
+    output = results_path(output_term)
+    papers, rows, unique = write_combined(files, selected, pub_to_number, output)
+    write_compact(output)
+
+    metadata = [read_metadata(term) for term in terms]
+    query = combine_queries([data.get('query', term) for term, data in zip(terms, metadata)], operation)
+    dates = [data['search date'] for data in metadata if 'search date' in data]
+    write_metadata(output_term, query, papers, rows, unique, min(dates) if len(dates) == len(terms) else None)
+    print('%s: %d publications with %d chemicals (%d unique) are written to %s' % (output_term, papers, rows, unique, output))
+
+def term_of(input):
+    '''
+    This function returns the term of a results file (e.g. HILIC for results/HILIC_ChEBI_IDs.tsv), or the input itself if it is a term already.
+    '''
+    return PurePath(input).name.split('_ChEBI_IDs')[0]
+
+def parser():
+    parser = argparse.ArgumentParser(description='This script makes a new results file from existing results files with a set operation on their publications, without searching Europe PMC again')
+    parser.add_argument('-i', required=True, nargs='+', metavar='terms', dest='terms', help='[i] to select the terms (e.g. HILIC APCI) or results files to combine, from left to right')
+    parser.add_argument('-m', required=True, choices=list(OPERATIONS.keys()), metavar='operation', dest='operation', help='[m] to select the set operation: union, intersection or difference (the publications of the first term that are not in the others)')
+    parser.add_argument('-o', required=True, metavar='output_term', dest='output_term', help='[o] to name the new term, which gets a results file and metadata like a searched term')
+    arguments = parser.parse_args()
+    return arguments
+
+def main():
+    args = parser()
+    terms = [term_of(input) for input in args.terms]
+    if len(terms) < 2:
+        sys.exit('Error: please give at least two terms to combine')
+    for term in terms:
+        if not os.path.isfile(results_path(term)):
+            sys.exit('Error: results file %s not found' % results_path(term))
+    if args.output_term in terms:
+        sys.exit('Error: the new term %s would overwrite the results of one of the terms' % args.output_term)
+    # the publications of a sample stand for more publications than they are, so they cannot be combined with a set operation
+    for term in terms:
+        if 'sampling fraction' in read_metadata(term):
+            sys.exit('Error: the results of %s are a sample (see --sample-size), only the results of full searches can be combined' % term)
+    combine_results(terms, args.operation, args.output_term)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+import os
+import tempfile
+import zipfile
+import numpy as np
+import numpy.lib.format
+import pandas as pd
+
+# Number of rows of a results file that are read at a time
+CHUNK_SIZE = 1000000
+
+def compact_file(file):
+    '''
+    This function returns the name of the compact results file that belongs to a results file (e.g. results/HILIC_ChEBI_IDs.npz for results/HILIC_ChEBI_IDs.tsv).
+    '''
+    return os.path.splitext(file)[0] + '.npz'
+
+def write_npy(npz, name, dtype, length, blocks):
+    '''
+    This function writes an array of 'length' elements to the .npz (zip) file block by block, as np.savez would write it, without having the whole array in memory.
+    '''
+    with npz.open(name + '.npy', 'w', force_zip64=True) as f:
+        numpy.lib.format.write_array_header_1_0(f, {'descr': numpy.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (length,)})
+        for block in blocks:
+            f.write(np.ascontiguousarray(block, dtype=dtype).tobytes())
+
+def write_compact(file, chunk_size=CHUNK_SIZE):
+    '''
+    This function reads a results file (one row per chemical mention) and writes it again as a compact results file next to it, and returns the name of the compact file.
+    Identical (ChEBI ID, publication) rows are stored once, with the number of mentions. The columns are integer arrays in a compressed .npz file:
+        - chebi: the ChEBI ID
+        - pub: the position of the publication ID in 'publications'
+        - mention_count: the number of rows of this ChEBI ID and publication in the results file
+    The publication ID's are stored once each, in the order of the results file.
+    The results file is read in chunks and the columns are collected in temporary files, so memory use does not grow with the size of the results file.
+    This relies on the rows of a publication being next to each other, as search_query.py writes them: the rows of the last publication of a chunk are kept back for the next chunk.
+    '''
+    columns = {name: tempfile.TemporaryFile() for name in ['chebi', 'pub', 'mention_count']}
+    pub_ids = tempfile.TemporaryFile()
+    sizes = {'publications': 0, 'pairs': 0, 'width': 1}
+
+    def add_rows(chebi, publications):
+        # number the publications of the rows, a new number wherever the publication changes
+        new = np.ones(len(publications), dtype=bool)
+        new[1:] = publications[1:] != publications[:-1]
+        pub = np.cumsum(new) - 1
+        pairs, mention_count = np.unique(pub * 2**32 + chebi, return_counts=True)
+        columns['chebi'].write((pairs % 2**32).astype(np.int32).tobytes())
+        columns['pub'].write((pairs // 2**32 + sizes['publications']).astype(np.int32).tobytes())
+        columns['mention_count'].write(mention_count.astype(np.int32).tobytes())
+
+        first = publications[new].tolist()
+        pub_ids.write(''.join(pub_id + '\n' for pub_id in first).encode('utf-8'))
+        sizes['width'] = max([sizes['width']] + [len(pub_id) for pub_id in first])
+        sizes['publications'] += len(first)
+        sizes['pairs'] += len(pairs)
+
+    try:
+        chunks = pd.read_csv(file, sep='\t', header=None, dtype={0: "int64", 1: "str"}, chunksize=chunk_size)
+    except pd.errors.EmptyDataError:
+        chunks = []
+    held_chebi = np.zeros(0, dtype=np.int64)
+    held_publications = np.zeros(0, dtype=object)
+    for chunk in chunks:
+        chebi = np.concatenate([held_chebi, chunk[0].to_numpy()])
+        publications = np.concatenate([held_publications, chunk[1].to_numpy(dtype=object)])
+        others = np.flatnonzero(publications != publications[-1])
+        last = others[-1] + 1 if len(others) > 0 else 0
+        held_chebi, held_publications = chebi[last:], publications[last:]
+        if last > 0:
+            add_rows(chebi[:last], publications[:last])
+    if len(held_chebi) > 0:
+        add_rows(held_chebi, held_publications)
+
+    BLOCK_SIZE = 1 << 22
+    compact = compact_file(file)
+    with zipfile.ZipFile(compact, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as npz:
+        for name, column in columns.items():
+            column.seek(0)
+            write_npy(npz, name, np.dtype(np.int32), sizes['pairs'], (np.frombuffer(block, dtype=np.int32) for block in iter(lambda: column.read(BLOCK_SIZE), b'')))
+            column.close()
+        pub_ids.seek(0)
+        blocks = ([line.decode('utf-8').rstrip('\n') for line in lines] for lines in iter(lambda: pub_ids.readlines(BLOCK_SIZE), []))
+        write_npy(npz, 'publications', np.dtype('<U%d' % sizes['width']), sizes['publications'], blocks)
+        pub_ids.close()
+    return compact
+
+def read_compact(file):
+    '''
+    This function reads a compact results file and returns its columns in a dictionary ('chebi', 'pub', 'mention_count' and 'publications' as keys).
+    '''
+    with np.load(file, allow_pickle=False) as npz:
+        return {key: npz[key] for key in npz.files}
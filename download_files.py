@@ -1,18 +1,20 @@
 #!/usr/bin/python
 
 import os
-import requests
 import json 
 import shutil
 import tqdm
 import collections
+import http_client
+from file_releases import get_repo_to_rel
 
 def download_files(file_to_link, folder):
     '''
     This function downloads the missing files from the OSF project (https://osf.io/pvwu2/).
     '''
     for file, link in file_to_link.items():
-        r = requests.get(link, stream=True)
+        r = http_client.get(link, stream=True)
+        r.raw.decode_content = True
         file_size = int(r.headers['Content-Length'])
         desc = 'Downloading %s' % file
         path = os.path.join(folder, file)
@@ -28,7 +30,7 @@ def get_response(url):
     '''
     This function returns url response.
     '''
-    response = requests.get(url)
+    response = http_client.get(url)
     response = json.loads(response.text)
     return response
 
@@ -56,23 +58,6 @@ def get_osf_to_rel(url):
 
     return ofs_to_rel
 
-def get_repo_to_rel(folder):
-    '''
-    This function ....
-    '''
-    files = os.listdir(folder)
-    repo_to_rel = collections.defaultdict(dict)
-
-    for file_name in files:
-        rel = file_name.split("_")[1].split(".")[0]
-        file = file_name.split("_")[0]
-        path = os.path.join(folder, file_name)
-
-        repo_to_rel[file]["rel"] = rel
-        repo_to_rel[file]["path"] = path
-        
-    return repo_to_rel
-
 def get_files_to_download(osf_to_rel, repo_to_rel):
     
     files_to_download = {}
@@ -112,6 +97,7 @@ def main():
     files_to_download = get_files_to_download(osf_to_rel, repo_to_rel)
 
     download_files(files_to_download, folder)
+    print(http_client.stats_report())
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,22 @@
+#!/usr/bin/python
+
+import os
+import collections
+
+def get_repo_to_rel(folder):
+    '''
+    This function returns the release and path of every file in the files folder (e.g. ChEBI2Names_rel208.tsv), with the file name without release as key.
+    It only reads the folder, so the table scripts can check the releases without the download dependencies.
+    '''
+    files = os.listdir(folder)
+    repo_to_rel = collections.defaultdict(dict)
+
+    for file_name in files:
+        rel = file_name.split("_")[1].split(".")[0]
+        file = file_name.split("_")[0]
+        path = os.path.join(folder, file_name)
+
+        repo_to_rel[file]["rel"] = rel
+        repo_to_rel[file]["path"] = path
+        
+    return repo_to_rel
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+
+import json
+import time
+import datetime
+import threading
+import collections
+
+# Upper bounds (in seconds) of the latency histogram buckets: 10 ms, 20 ms, 40 ms, ... up to 82 seconds, and one bucket for slower requests
+LATENCY_BUCKETS = [0.01 * 2**i for i in range(14)] + [float('inf')]
+
+class LatencyHistogram:
+    '''
+    This class counts request latencies in buckets that double in width (see LATENCY_BUCKETS), so that percentiles can be estimated without keeping every latency.
+    '''
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, latency):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, q):
+        '''
+        This function returns the upper bound of the bucket that holds the q-th percentile (e.g. q=95), or the maximum latency for the last bucket.
+        '''
+        needed = self.count * q / 100
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= needed and seen > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        histogram = {('<=%g' % bound if bound != float('inf') else '>%g' % LATENCY_BUCKETS[-2]): count for bound, count in zip(LATENCY_BUCKETS, self.counts) if count > 0}
+        return {'count': self.count, 'mean': self.total / self.count if self.count > 0 else 0, 'p50': self.percentile(50), 'p95': self.percentile(95),
+            'p99': self.percentile(99), 'max': self.max, 'histogram': histogram}
+
+class HarvestStats:
+    '''
+    This class keeps the numbers of one harvest: request latencies per endpoint ('search' or 'annotations'), retries and failures by cause, bytes received,
+    and the number of search pages, publications and annotation downloads. The downloads run in several threads, so every update takes a lock.
+    'progress' gives a short line with the throughput so far, and 'write_report' writes all numbers to a json file next to the metadata of the term.
+    '''
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.latency = collections.defaultdict(LatencyHistogram)
+        self.bytes = collections.Counter()
+        self.json_bytes = collections.Counter()
+        self.retries = collections.Counter()
+        self.failures = collections.Counter()
+        self.pages = 0
+        self.publications = 0
+        self.search_filter = None
+        self.sampling = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.offline = None
+        self.lock = threading.Lock()
+
+    def request(self, endpoint, latency, size, json_size):
+        '''
+        This function records a successful download: its latency in seconds, its size on the wire and the size of the (decompressed) json.
+        '''
+        with self.lock:
+            self.latency[endpoint].add(latency)
+            self.bytes[endpoint] += size
+            self.json_bytes[endpoint] += json_size
+
+    def retry(self, cause):
+        with self.lock:
+            self.retries[cause] += 1
+
+    def failure(self, cause):
+        with self.lock:
+            self.failures[cause] += 1
+
+    def page(self, publications):
+        '''
+        This function records a finished search page with the number of publications with text mined terms on it.
+        '''
+        with self.lock:
+            self.pages += 1
+            self.publications += publications
+
+    def filter(self, query_filter, hits, filtered_hits):
+        '''
+        This function records that the search query was restricted with a filter (e.g. HAS_TM:Y), with the number of hits without and with the filter.
+        '''
+        self.search_filter = {'filter': query_filter, 'hits without filter': hits, 'hits with filter': filtered_hits}
+
+    def sample(self, sampler, population, target):
+        '''
+        This function records that only a sample of the publications is annotated (see sampling.py), with the number of publications with text mined terms
+        and the sample size that was aimed for.
+        '''
+        self.sampling = {'sampler': sampler, 'population': population, 'target sample size': target}
+
+    def cache(self, hits, misses, offline=False):
+        '''
+        This function records the publications that were found in the annotation cache (or offline store) and the ones that were not.
+        '''
+        with self.lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+            self.offline = offline
+
+    def wall_time(self):
+        return time.monotonic() - self.start
+
+    def progress(self):
+        '''
+        This function returns a line with the throughput so far: search pages and annotation downloads per second and the number of megabytes received.
+        '''
+        wall_time = max(self.wall_time(), 1e-9)
+        return '%.2f pages/s, %.1f annotations/s, %.1f MB received' % (self.pages / wall_time, self.latency['annotations'].count / wall_time, sum(self.bytes.values()) / 1e6)
+
+    def report(self):
+        '''
+        This function returns the numbers of the harvest as a dictionary.
+        '''
+        with self.lock:
+            wall_time = self.wall_time()
+            report = {
+                'started': self.started,
+                'wall time': wall_time,
+                'pages': self.pages,
+                'publications': self.publications,
+                'annotation downloads': self.latency['annotations'].count,
+                'pages/s': self.pages / wall_time if wall_time > 0 else 0,
+                'annotations/s': self.latency['annotations'].count / wall_time if wall_time > 0 else 0,
+                'bytes received': dict(self.bytes),
+                'json bytes': dict(self.json_bytes),
+                'latency': {endpoint: histogram.summary() for endpoint, histogram in self.latency.items() if histogram.count > 0},
+                'retries': dict(self.retries),
+                'failures': dict(self.failures),
+            }
+            if self.pages > 0:
+                report['search bytes per page'] = self.bytes['search'] / self.pages
+            if self.publications > 0:
+                report['search bytes per publication'] = self.bytes['search'] / self.publications
+            if self.offline != None:
+                total = self.cache_hits + self.cache_misses
+                report['annotation store' if self.offline else 'annotation cache'] = {'hits': self.cache_hits, 'misses': self.cache_misses,
+                    'hit rate': self.cache_hits / total if total > 0 else 0}
+
+        # The filtered search skips the hits without text mined terms: their search results are not downloaded at all
+        if self.search_filter != None:
+            search_filter = dict(self.search_filter)
+            hits = search_filter['hits without filter']
+            skipped = hits - search_filter['hits with filter']
+            search_filter['hits skipped'] = skipped
+            search_filter['fraction skipped'] = skipped / hits if hits > 0 else 0
+            report['search filter'] = search_filter
+
+        if self.sampling != None:
+            sampling = self.sampling['sampler'].summary()
+            sampling['publications with text mined terms'] = self.sampling['population']
+            sampling['target sample size'] = self.sampling['target sample size']
+            report['sampling'] = sampling
+        return report
+
+    def write_report(self, term, query):
+        '''
+        This function writes the report of the harvest to metadata/<term>.json, next to the metadata file of the term.
+        '''
+        report = {'term': term, 'query': query}
+        report.update(self.report())
+        with open('metadata/'+str(term)+'.json', 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+import threading
+import requests
+
+# One session is shared by all downloads, so that connections to Europe PMC and OSF are kept alive and reused
+SESSION = None
+POOL_SIZE = 10
+LOCK = threading.Lock()
+
+def get_session(pool_size=None):
+    '''
+    This function returns the shared requests session, and creates it on first use.
+    The session keeps up to 'pool_size' connections per host open (keep-alive), and responses are gzip compressed by the server and decoded by requests.
+    If a larger pool size is asked for than the current session has, a new session with the larger pool is created.
+    '''
+    global SESSION, POOL_SIZE
+    with LOCK:
+        if pool_size != None and pool_size > POOL_SIZE:
+            POOL_SIZE = pool_size
+            SESSION = None
+        if SESSION == None:
+            SESSION = requests.Session()
+            SESSION.headers.update({'Accept-Encoding': 'gzip, deflate', 'User-Agent': 'SCOPE (https://github.com/ReinV/SCOPE)'})
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+            SESSION.mount('https://', adapter)
+            SESSION.mount('http://', adapter)
+    return SESSION
+
+def get(url, timeout=None, stream=False):
+    '''
+    This function sends a GET request over the shared session and returns the response.
+    '''
+    return get_session().get(url, timeout=timeout, stream=stream)
+
+def connection_stats():
+    '''
+    This function returns the number of requests sent and connections opened by the shared session, and the number of requests that reused an open connection.
+    The counts are taken from the connection pools of the session (one pool per host).
+    '''
+    stats = {'requests': 0, 'connections': 0, 'reused': 0}
+    if SESSION == None:
+        return stats
+
+    for adapter in set(SESSION.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            if pool == None:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+    stats['reused'] = max(0, stats['requests'] - stats['connections'])
+    return stats
+
+def stats_report():
+    '''
+    This function returns a line that summarizes the connection reuse of the shared session.
+    '''
+    stats = connection_stats()
+    rate = 100 * stats['reused'] / stats['requests'] if stats['requests'] > 0 else 0
+    return 'http: %d requests over %d connections (%d reused, %.1f%%)' % (stats['requests'], stats['connections'], stats['reused'], rate)
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+import argparse
+import gzip
+import json
+import os
+import sys
+from annotation_cache import AnnotationCache
+from search_query import parse_annotations
+
+def open_dump(file):
+    '''
+    This function opens a dump file for reading text, also when it is gzip compressed (.gz).
+    '''
+    if file.endswith('.gz'):
+        return gzip.open(file, 'rt', encoding='utf-8')
+    return open(file, 'r', encoding='utf-8')
+
+def read_dump(file, batch_size):
+    '''
+    This function reads a dump file line by line and yields its articles in lists of at most 'batch_size' articles, so that a dump file never has to fit in memory.
+    Every line holds one article in the format of the annotationsByArticleIds endpoint (with 'extId', 'source' and 'annotations'), empty lines are skipped.
+    '''
+    batch = []
+    with open_dump(file) as f:
+        for number, line in enumerate(f, 1):
+            if line.strip() == '':
+                continue
+            try:
+                batch.append(json.loads(line))
+            except json.JSONDecodeError:
+                sys.exit('Error: line %d of %s is not a json article' % (number, file))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def ingest_dump(file, store, batch_size=10000):
+    '''
+    This function adds the annotations of type 'Chemicals' of all articles in the dump file to the annotation store, and returns the number of articles.
+    Articles are stored with "source:extId" as key like in the annotation cache, also when they have no chemicals, so that the harvester knows they are done.
+    The chemicals of an article that is also on other lines or in other dump files are merged with the ones stored before (see 'AnnotationCache.merge').
+    '''
+    articles = 0
+    for batch in read_dump(file, batch_size):
+        store.merge([((article['extId'], article['source']), parse_annotations([article], dict()).get(article['extId'], [])) for article in batch])
+        articles += len(batch)
+        print('%s: %d articles ingested' % (file, articles))
+    return articles
+
+def parser():
+    parser = argparse.ArgumentParser(description='This script reads Europe PMC annotation dump files into a local annotation store, which search_query.py can use instead of the annotations api')
+    parser.add_argument('-i', required=True, nargs='+', metavar='dump_files', dest='dump_files', help='[i] to select the dump files (one json article per line, optionally .gz) or a folder with dump files')
+    parser.add_argument('-o', required=False, default='cache/annotation_store.sqlite', metavar='store_file', dest='store_file', help='[o] to select the annotation store file, default=cache/annotation_store.sqlite')
+    arguments = parser.parse_args()
+    return arguments
+
+def main():
+    args = parser()
+    files = []
+    for input in args.dump_files:
+        if os.path.isdir(input):
+            files.extend(sorted(os.path.join(input, file) for file in os.listdir(input)))
+        else:
+            files.append(input)
+
+    store = AnnotationCache(args.store_file)
+    articles = sum(ingest_dump(file, store) for file in files)
+    store.close()
+    print('%d articles from %d dump files are in %s' % (articles, len(files), args.store_file))
+
+if __name__ == '__main__':
+    main()
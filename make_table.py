@@ -1,66 +1,151 @@
 #!/usr/bin/python
 
 import argparse
+import concurrent.futures
 import math
 import sys
 import pandas as pd
 import numpy as np
 import os
 from pathlib import PurePath
+from compact_results import compact_file, read_compact
+from property_store import open_store, PropertyStore, STORE_FOLDER
+from build_manifest import BuildManifest, property_release
+from publication_matrix import build_matrix, save_matrix, matrix_file, read_pairs
+from search_metadata import read_metadata
+
+# Folder with the property files
+FILES_FOLDER = 'files'
+
+# Number of rows of a results file that are read at a time
+CHUNK_SIZE = 1000000
+
+# Property store of a worker process in parallel mode (see 'start_worker')
+DATA = None
 
 def import_properties():
     '''
-    This function reads a file and adds the information + id in a dictionary. This is added to another dictionary as value, and the term that describes the
-    information (e.g. "Names") as key.
-    '''
-    FOLDER = 'files'
-    files = os.listdir(FOLDER)
-    data = dict()
-    for file in files:
-        path = os.path.join(FOLDER, file)
-        key = file.split('2')[1].split('_')[0]
-        if '.pkl' in file:
-            df = pd.read_pickle(path)
-            df['ChEBI'] = df['ChEBI'].astype(int)
-            df = df.set_index('ChEBI')
-        else:
-            df = pd.read_csv(path, sep='\t', header=None, names=['ChEBI', 'Info'], index_col='ChEBI', dtype={"ChEBI": "int", "Info": "str"})
-        id_to_info = df.to_dict()
-        data[key] = id_to_info
-    return data
+    This function opens the property store with the information of every file in the files folder, with the term that describes the information (e.g. "Names") as key.
+    The store is compiled from the files the first time, and again when the files change (see property_store.py). After that, opening it is almost instant.
+    '''
+    return open_store(FILES_FOLDER)
 
 def get_info(data, key, id):
     '''
     This function recieves:
         - a ChEBI identifier
-        - a dictionary key indicating the type of information
-        - data dictionary containing information of every ChEBI identifier
-    The function returns specific information retrieved from the data dictionary (e.g. Name or Mass)
+        - a key indicating the type of information
+        - the property store containing information of every ChEBI identifier
+    The function returns specific information retrieved from the property store (e.g. Name or Mass), NaN if there is none
     '''
-    try:
-        info = data[key]['Info'][id]
-    except:
-        info = float('NaN')
-    return info
+    return data.get(key, id)
 
 def make_table(data, df_results):
     '''
-    This function recieves the data of all the ChEBI files in the files folder and the ids of the query search.
-    It returns a dictionary of the query ids and their properties from the ChEBI files, if those properties are there.
-    e.g. if there is no logP value, the id is not added to the dictionary that is returned.
+    This function recieves the property store of all the ChEBI files in the files folder and the ids of the query search.
+    It returns a dataframe of the query ids and their properties from the ChEBI files, if those properties are there.
+    e.g. if there is no logP value, the id is not added to the dataframe that is returned.
+    The ids without all properties are left out first (the store has "-" values as NaN already), so only the properties of the remaining ids are looked up,
+    and these are joined to the counts at once.
     '''
-    table = df_results
-    # create column lists
+    ids = df_results.index.to_numpy()
+    complete = np.ones(len(ids), dtype=bool)
     for key in data.keys():
-        column_list = [get_info(data, key, id) for id in df_results.index.to_list()]
-
-        table.loc[:,key] = column_list
+        complete &= data.has_value(key, ids)
 
-    table = table.replace({'Mass': {"-": np.nan}, 'logP': {"-": np.nan}})
-    table = table.dropna()
+    table = df_results[complete]
+    properties = pd.DataFrame({key: data.lookup(key, ids[complete]) for key in data.keys()}, index=table.index)
+    table = table.join(properties)
     table = table.sort_values(by='Count', ascending=False)
     return table
 
+def results_file(result):
+    '''
+    This function returns the file to read the results of a term from: the compact results file (.npz) if it is there and not older than the
+    results file (.tsv), and the given file otherwise.
+    '''
+    compact = compact_file(result)
+    if result.endswith('.npz') or not os.path.isfile(compact):
+        return result
+    if not os.path.isfile(result) or os.path.getmtime(compact) >= os.path.getmtime(result):
+        return compact
+    return result
+
+def add_counts(counts, ids):
+    '''
+    This function adds the number of times every ChEBI ID occurs in 'ids' to the counts array (ChEBI ID as position), and returns the counts array,
+    which grows when a larger ChEBI ID comes along.
+    '''
+    chunk_counts = np.bincount(ids)
+    if len(chunk_counts) > len(counts):
+        counts = np.concatenate([counts, np.zeros(len(chunk_counts) - len(counts), dtype=np.int64)])
+    counts[:len(chunk_counts)] += chunk_counts
+    return counts
+
+def count_papers(papers, ids, publications):
+    '''
+    This function adds the number of distinct publications of every ChEBI ID in a chunk of rows to the papers array (ChEBI ID as position), and returns it.
+    '''
+    codes = pd.factorize(publications)[0].astype(np.int64)
+    pairs = np.unique(codes * (int(ids.max()) + 1) + ids)
+    return add_counts(papers, pairs % (int(ids.max()) + 1))
+
+def stream_results(result, papers=False, chunk_size=CHUNK_SIZE):
+    '''
+    This function reads a results file (.tsv) in chunks of 'chunk_size' rows and adds up the mentions of every ChEBI ID in an integer array, so that memory use
+    depends on the number of distinct ChEBI ID's and not on the size of the file. Without 'papers', the publication column is not read at all.
+    With 'papers', the number of distinct publications per ChEBI ID is counted as well. search_query.py writes the rows of a publication one after another,
+    so the rows of the last publication of a chunk are kept back for the next chunk, and duplicates only have to be found within a chunk.
+    '''
+    counts = np.zeros(0, dtype=np.int64)
+    paper_counts = np.zeros(0, dtype=np.int64)
+    held_ids = np.zeros(0, dtype=np.int64)
+    held_publications = np.zeros(0, dtype=object)
+
+    columns = [0, 1] if papers else [0]
+    try:
+        chunks = pd.read_csv(result, sep = '\t', header=None, usecols=columns, dtype={0: "int64", 1: "str"}, chunksize=chunk_size)
+    except pd.errors.EmptyDataError:
+        # a query without hits has an empty results file, which gives an empty table
+        chunks = []
+    for chunk in chunks:
+        ids = chunk[0].to_numpy()
+        counts = add_counts(counts, ids)
+        if not papers:
+            continue
+
+        ids = np.concatenate([held_ids, ids])
+        publications = np.concatenate([held_publications, chunk[1].to_numpy(dtype=object)])
+        others = np.flatnonzero(publications != publications[-1])
+        last = others[-1] + 1 if len(others) > 0 else 0
+        held_ids, held_publications = ids[last:], publications[last:]
+        if last > 0:
+            paper_counts = count_papers(paper_counts, ids[:last], publications[:last])
+
+    if len(held_ids) > 0:
+        paper_counts = count_papers(paper_counts, held_ids, held_publications)
+
+    found = np.flatnonzero(counts)
+    df = pd.DataFrame({'Count': counts[found]}, index=pd.Index(found, name='ChEBI'))
+    if papers:
+        # every ChEBI ID with mentions has a publication, so the papers array is as long as the counts array
+        df.loc[:,'Papers'] = paper_counts[found]
+    return df
+
+def read_results(result, papers=False):
+    '''
+    This function reads a results file (.tsv) or compact results file (.npz), and returns the number of mentions per ChEBI ID in a dataframe
+    (ChEBI ID as index, "Count" as column). With 'papers', the number of distinct publications per ChEBI ID is added as "Papers" column.
+    '''
+    if result.endswith('.npz'):
+        columns = read_compact(result)
+        # every (ChEBI ID, publication) pair is in the compact file once
+        df = pd.DataFrame({'ChEBI': columns['chebi'].astype(int), 'Count': columns['mention_count'].astype(int), 'Papers': 1})
+        df = df.groupby(by=['ChEBI']).sum()
+        return df if papers else df.drop(columns='Papers')
+
+    return stream_results(result, papers)
+
 def write_to_file(table, term):
     '''
     This function writes the table in a .pkl file for easy importation into the visualization script,
@@ -70,10 +155,114 @@ def write_to_file(table, term):
     table.to_csv(path+'_table.tsv', sep='\t')
     table.to_pickle(path+'_table.pkl')
 
+def sampling_fraction(term):
+    '''
+    This function returns the sampling fraction of a term from its metadata: the share of the publications that were annotated, 1 for a full search.
+    '''
+    return float(read_metadata(term).get('sampling fraction', 1))
+
+def scale_sample(result, df_results, fraction):
+    '''
+    This function turns the counts of a sample of publications into estimates for all publications. The counts of the sample are kept as "SampleCount",
+    and "Count" is divided by the sampling fraction. A "Papers" column (see -p) is scaled in the same way, with the papers of the sample kept as "SamplePapers". Every publication was in the sample with a chance of 'fraction', so the variance of the estimated
+    count of a chemical is (1 - fraction) / fraction^2 times the sum of its squared mentions per publication. This is kept as "CountVar",
+    so that the plot scripts can add it up per hexagon.
+    '''
+    chebi, pub, mentions, publications = read_pairs(result)
+    # mentions of every chemical in every publication
+    pairs, positions = np.unique(chebi * max(len(publications), 1) + pub, return_inverse=True)
+    pair_mentions = np.bincount(positions, weights=mentions)
+    squares = np.bincount(pairs // max(len(publications), 1), weights=pair_mentions**2)
+
+    ids = df_results.index.to_numpy()
+    df_results.loc[:,'SampleCount'] = df_results['Count']
+    df_results.loc[:,'Count'] = (df_results['Count'] / fraction).round().astype(int)
+    df_results.loc[:,'CountVar'] = (1 - fraction) / fraction**2 * squares[ids]
+    if 'Papers' in df_results.columns:
+        df_results.loc[:,'SamplePapers'] = df_results['Papers']
+        df_results.loc[:,'Papers'] = (df_results['Papers'] / fraction).round().astype(int)
+    return df_results
+
+def filter_class(data, df_results, class_id):
+    '''
+    This function keeps only the ChEBI ID's of the results that belong to class "class_id" in the ChEBI ontology, also through their higher level classes.
+    The class index of the property store makes this one array lookup for all ChEBI ID's at once.
+    '''
+    return df_results[data.class_index().in_class(df_results.index.to_numpy(), class_id)]
+
+def table_term(result, class_id=None):
+    '''
+    This function returns the name of the table of a results file: the query search term, with "_class<class_id>" for a table of one class.
+    '''
+    term = PurePath(result).name.split('_ChEBI_IDs')[0]
+    if class_id != None:
+        term = '%s_class%d' % (term, class_id)
+    return term
+
+def build_table(data, result, class_id=None, papers=False, matrix=False):
+    '''
+    This function makes the table of one results file, adds the TFIDF column and writes the table to the tables folder.
+    With a "class_id", the table only holds the chemicals of that class and is named <term>_class<class_id>.
+    With 'papers', the table has a "Papers" column with the number of distinct publications of every chemical.
+    With 'matrix', the chemical x publication matrix of the results is written next to the table (see publication_matrix.py).
+    '''
+    result = results_file(result)
+    term = table_term(result, class_id)
+    print('making table for %s' % term)
+
+    # import results
+    df_results = read_results(result, papers)
+    fraction = sampling_fraction(PurePath(result).name.split('_ChEBI_IDs')[0])
+    if fraction < 1:
+        print('%s is a sample of %.4g of the publications, the counts are scaled up' % (term, fraction))
+        df_results = scale_sample(result, df_results, fraction)
+    if class_id != None:
+        df_results = filter_class(data, df_results, class_id)
+
+    # make table
+    table = make_table(data, df_results)
+
+    # perform normalization
+    table.loc[:,"TFIDF"] = table["Count"].astype(float)*table["idf"].astype(float)
+    table.loc[:,"TFIDF"] = table.loc[:,"TFIDF"].round(decimals=0).astype(int)
+    print(table)
+
+    # write table to file
+    write_to_file(table, term)
+    if matrix:
+        save_matrix(matrix_file(term), *build_matrix(result))
+    return term
+
+def start_worker(store_folder):
+    '''
+    This function opens the property store in a worker process. The store is memory-mapped, so all workers share the same pages of the store in memory
+    instead of holding a copy each.
+    '''
+    global DATA
+    DATA = PropertyStore(store_folder)
+
+def build_table_in_worker(result, class_id, papers, matrix):
+    return build_table(DATA, result, class_id, papers, matrix)
+
+def build_tables(results, workers, class_id=None, papers=False, matrix=False):
+    '''
+    This function makes the tables of the results files in 'workers' processes at the same time, and returns the terms in the order they were finished.
+    '''
+    terms = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=start_worker, initargs=(STORE_FOLDER,)) as executor:
+        for future in concurrent.futures.as_completed([executor.submit(build_table_in_worker, result, class_id, papers, matrix) for result in results]):
+            terms.append(future.result())
+    return terms
+
 def parser():
     parser = argparse.ArgumentParser(description='This script makes a table of the query IDs, their names and their properties')
     parser.add_argument('-i', required=True, metavar='input', dest='input', help='[i] to select input folder or input file from the results folder ')
     parser.add_argument('-t', required=True, metavar='type', dest='type', help='[t] to select type of input: file or folder')
+    parser.add_argument('-w', required=False, type=int, default=1, metavar='workers', dest='workers', help='[w] to select the number of tables that are made at the same time in folder mode, default=1')
+    parser.add_argument('--force', default=False, action='store_true', dest='force', help='[force] to make all tables again, also the ones that are up to date')
+    parser.add_argument('-p', '--papers', default=False, action='store_true', dest='papers', help='[p] to add the number of distinct publications of every chemical to the tables')
+    parser.add_argument('-m', '--matrix', default=False, action='store_true', dest='matrix', help='[m] to also write the chemical x publication matrix of every table (tables/<term>_matrix.npz)')
+    parser.add_argument('-c', required=False, type=int, metavar='class_id', dest='class_id', help='[c] to make tables with only the chemicals of a ChEBI class (e.g. 35366 for fatty acids)')
     arguments = parser.parse_args()
     return arguments
 
@@ -85,31 +274,35 @@ def main():
         results = [input]
     elif input_type == 'folder':
         files = os.listdir(input)
-        results = [input+'/'+file for file in files]
+        # every term is made once, from its compact results file if there is one
+        results = sorted(set(results_file(input+'/'+file.replace('.npz', '.tsv')) for file in files))
     else:
         sys.exit('Error: please give \'file\' or \'folder\' as input type')
 
-    #gather properties
-    data = import_properties()
+    # leave out the tables that were made from the same results and property release before
+    manifest = BuildManifest()
+    release = property_release(FILES_FOLDER)
+    options = {'class': args.class_id, 'papers': args.papers, 'matrix': args.matrix}
+    stale = [result for result in results if args.force or not manifest.is_up_to_date(table_term(result, args.class_id), results_file(result), release, options)]
+    if len(stale) < len(results):
+        print('%d of %d tables are up to date' % (len(results) - len(stale), len(results)))
+    if len(stale) == 0:
+        return
 
-    for result in results:
-        term = PurePath(result).parts[1].split('_ChEBI_IDs.tsv')[0]
-        print('making table for %s' % term)
-
-        # import results
-        df = pd.read_csv(result, sep = '\t', names=['ChEBI', 'Publication'], dtype={"ChEBI": "int", "Publication": "str"})
-        df_results = df.groupby(by=['ChEBI']).count().rename(columns={"Publication": "Count"})
-
-        # make table
-        table = make_table(data, df_results)
+    #gather properties (this compiles the property store if needed, before any worker opens it)
+    data = import_properties()
 
-        # perform normalization
-        table.loc[:,"TFIDF"] = table["Count"].astype(float)*table["idf"].astype(float)
-        table.loc[:,"TFIDF"] = table.loc[:,"TFIDF"].round(decimals=0).astype(int)
-        print(table)
+    if args.workers > 1 and len(stale) > 1:
+        build_tables(stale, args.workers, args.class_id, args.papers, args.matrix)
+        for result in stale:
+            manifest.record(table_term(result, args.class_id), results_file(result), release, options)
+        manifest.save()
+        return
 
-        # write table to file
-        write_to_file(table, term)
+    for result in stale:
+        build_table(data, result, args.class_id, args.papers, args.matrix)
+        manifest.record(table_term(result, args.class_id), results_file(result), release, options)
+        manifest.save()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+
+import argparse
+import csv
+import datetime
+import re
+import zlib
+import gzip
+import json
+import random
+import threading
+import time
+import collections
+import urllib.parse
+import http.server
+
+def synthetic_corpus(size, tmt_fraction=0.8, mean_chemicals=20, seed=0):
+    '''
+    This function creates a synthetic corpus of 'size' publications, and returns it as a list of (publication ID, source, ChEBI ID's) tuples.
+    About 'tmt_fraction' of the publications have text mined terms, these get a random number of chemical mentions (on average 'mean_chemicals').
+    Publications without text mined terms get None instead of a list of ChEBI ID's.
+    '''
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        id = str(30000000 + i)
+        if rng.random() < tmt_fraction:
+            count = int(rng.expovariate(1 / mean_chemicals))
+            chebi_ids = [str(int(rng.paretovariate(1.2)) * 7 + 15000) for n in range(count)]
+        else:
+            chebi_ids = None
+        corpus.append((id, 'MED', chebi_ids))
+    return corpus
+
+def recorded_corpus(file):
+    '''
+    This function creates a corpus from an existing results file (e.g. results/HILIC_ChEBI_IDs.tsv), so that a search can be replayed with its real annotations.
+    It returns the same kind of list as 'synthetic_corpus'.
+    '''
+    pub_to_chebi = collections.OrderedDict()
+    with open(file, 'r', newline='', encoding="utf-8") as tsvfile:
+        for chebi_id, pub_id in csv.reader(tsvfile, delimiter = '\t'):
+            pub_to_chebi.setdefault(pub_id, []).append(chebi_id)
+    return [(pub_id, 'MED', chebi_ids) for pub_id, chebi_ids in pub_to_chebi.items()]
+
+def publication_date(id):
+    '''
+    This function returns a made-up but fixed publication date for a publication ID, between 2000 and 2021.
+    The mock uses it for both the first publication date (FIRST_PDATE) and the first index date (FIRST_IDATE).
+    '''
+    number = int(id) if id.isdigit() else zlib.crc32(id.encode())
+    return datetime.date(2000, 1, 1) + datetime.timedelta(days=(number * 7919) % 8036)
+
+def filter_corpus(corpus, query):
+    '''
+    This function returns the publications of the corpus that match the date ranges (FIRST_PDATE or FIRST_IDATE) and text mined terms filter (HAS_TM:Y) in the query.
+    Other parts of the query are ignored: every publication of the corpus matches them.
+    '''
+    if 'HAS_TM:Y' in query:
+        corpus = [publication for publication in corpus if publication[2] != None]
+    for field, start, end in re.findall(r'(FIRST_PDATE|FIRST_IDATE):\[(\S+) TO (\S+)\]', query):
+        start = datetime.date.fromisoformat(start)
+        end = datetime.date.fromisoformat(end)
+        corpus = [publication for publication in corpus if start <= publication_date(publication[0]) <= end]
+    return corpus
+
+def article_json(id, source, chebi_ids):
+    '''
+    This function returns the annotations of one publication in the format of the annotationsByArticleIds endpoint.
+    A non-chemical annotation is added as well, because the real annotations contain other types too.
+    '''
+    annotations = [{'exact': 'CHEBI:%s' % chebi_id, 'type': 'Chemicals', 'tags': [{'name': 'CHEBI:%s' % chebi_id, 'uri': 'http://purl.obolibrary.org/obo/CHEBI_%s' % chebi_id}]} for chebi_id in chebi_ids]
+    annotations.append({'exact': 'metabolomics', 'type': 'Gene Ontology', 'tags': [{'name': 'metabolomics', 'uri': 'http://purl.obolibrary.org/obo/GO_0008152'}]})
+    return {'source': source, 'extId': id, 'pmcid': None, 'annotations': annotations}
+
+def write_dump(corpus, file):
+    '''
+    This function writes the annotations of the corpus to a dump file for ingest_annotations.py: one article per line, gzip compressed if the file name ends with .gz.
+    Publications without text mined terms are left out, like in the dumps of Europe PMC.
+    '''
+    opener = gzip.open if file.endswith('.gz') else open
+    with opener(file, 'wt', encoding='utf-8') as f:
+        for id, source, chebi_ids in corpus:
+            if chebi_ids != None:
+                f.write(json.dumps(article_json(id, source, chebi_ids)) + '\n')
+
+class MockEuropePMC:
+    '''
+    This class runs a local stand-in for the Europe PMC search and annotations api in a background thread, to test and benchmark the harvester without the real api.
+    Search pages are chained with cursorMarks like the real api (the last page has no nextCursorMark), annotations are served per publication or in batches.
+    Every request waits 'latency' seconds (plus up to 'jitter' seconds), search pages 'search_latency' seconds longer, as they are slow to compute for the real api.
+    A fraction 'error_rate' of the requests fails with HTTP 429, HTTP 500, malformed json or a timeout. For a timeout the server stalls 'timeout' seconds
+    and then drops the connection without an answer, like a gateway that gives up, so the harvester sees a failed download whatever its own timeout is.
+    The number of requests and the number of sent bytes (in total and per endpoint) are counted in 'stats'.
+    '''
+
+    def __init__(self, corpus, latency=0, jitter=0, error_rate=0, timeout=15, seed=0, search_latency=0):
+        self.corpus = corpus
+        self.articles = {'%s:%s' % (source, id): (id, source, chebi_ids) for id, source, chebi_ids in corpus}
+        self.latency = latency
+        self.search_latency = search_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.stats = collections.Counter()
+        self.query_to_corpus = dict()
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self, port=0):
+        '''
+        This function starts the server on localhost (a free port by default) and returns its base url, which replaces https://www.ebi.ac.uk/europepmc.
+        '''
+        mock = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                mock.handle(self)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server.server_port
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def draw(self):
+        with self.lock:
+            return self.random.random()
+
+    def handle(self, request):
+        '''
+        This function answers one request: it waits for the latency, injects an error if the dice say so, and otherwise sends the search page or annotations.
+        '''
+        url = urllib.parse.urlparse(request.path)
+        parameters = urllib.parse.parse_qs(url.query)
+        endpoint = 'search' if url.path.endswith('/search') else 'annotations'
+        self.count(endpoint)
+        time.sleep(self.latency + self.jitter * self.draw())
+        if endpoint == 'search':
+            time.sleep(self.search_latency)
+
+        # Error injection
+        if self.draw() < self.error_rate:
+            error = self.random.choice(['429', '500', 'json', 'timeout'])
+            self.count('error ' + error)
+            if error == '429':
+                return self.send(request, 429, b'', {'Retry-After': '1'})
+            if error == '500':
+                return self.send(request, 500, b'')
+            if error == 'json':
+                return self.send(request, 200, b'{"resultList": ')
+            time.sleep(self.timeout)
+            request.close_connection = True
+            return
+
+        if endpoint == 'search':
+            data = self.search_page(parameters)
+        else:
+            article_ids = parameters.get('articleIds', [''])[0].split(',')
+            data = [article_json(*self.articles[article_id]) for article_id in article_ids if article_id in self.articles and self.articles[article_id][2]]
+        body = json.dumps(data).encode()
+
+        headers = {'Content-Type': 'application/json'}
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        self.count('bytes', len(body))
+        self.count('bytes ' + endpoint, len(body))
+        self.send(request, 200, body, headers)
+
+    def search_page(self, parameters):
+        '''
+        This function returns one page of search results, with short records for the idlist result type and longer ones otherwise (like lite).
+    The cursorMark encodes the position in the corpus.
+        '''
+        query = parameters.get('query', [''])[0]
+        page_size = int(parameters.get('pageSize', ['25'])[0])
+        cursorMark = parameters.get('cursorMark', ['*'])[0]
+        start = 0 if cursorMark == '*' else int(cursorMark.lstrip('AoE'))
+
+        with self.lock:
+            if query not in self.query_to_corpus:
+                self.query_to_corpus[query] = filter_corpus(self.corpus, query)
+            corpus = self.query_to_corpus[query]
+        publications = corpus[start:start+page_size]
+
+        if parameters.get('resultType', ['lite'])[0] == 'idlist':
+            results = [{'id': id, 'source': source, 'pmid': id} for id, source, chebi_ids in publications]
+        else:
+            results = [{'id': id, 'source': source, 'pmid': id, 'title': 'publication %s' % id, 'authorString': 'Author A, Author B, Author C.',
+                'journalTitle': 'Journal', 'pubYear': str(publication_date(id).year), 'firstPublicationDate': str(publication_date(id)),
+                'isOpenAccess': 'N', 'citedByCount': 0, 'hasTextMinedTerms': 'Y' if chebi_ids != None else 'N'} for id, source, chebi_ids in publications]
+        data = {'version': '6.5', 'hitCount': len(corpus), 'request': {'cursorMark': cursorMark, 'pageSize': page_size}, 'resultList': {'result': results}}
+        if start + page_size < len(corpus):
+            data['nextCursorMark'] = 'AoE%d' % (start + page_size)
+        return data
+
+    def send(self, request, code, body, headers={}):
+        request.send_response(code)
+        for key, value in headers.items():
+            request.send_header(key, value)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        try:
+            request.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def expected_results(self):
+        '''
+        This function returns the dictionary that a complete harvest of the corpus should give (publication ID's as keys, lists of ChEBI ID's as values).
+        '''
+        return {id: list(chebi_ids) for id, source, chebi_ids in self.corpus if chebi_ids}
+
+def parser():
+    parser = argparse.ArgumentParser(description='This script runs a local stand-in for the Europe PMC search and annotations api')
+    parser.add_argument('-n', required=False, type=int, default=10000, metavar='size', dest='size', help='[n] to select the number of synthetic publications, default=10000')
+    parser.add_argument('-r', required=False, metavar='results_file', dest='results_file', help='[r] to replay the publications and chemicals of a results file instead')
+    parser.add_argument('-l', required=False, type=float, default=0.05, metavar='latency', dest='latency', help='[l] to select the latency per request in seconds, default=0.05')
+    parser.add_argument('-s', required=False, type=float, default=1, metavar='search_latency', dest='search_latency', help='[s] to select the extra latency of search pages in seconds, default=1')
+    parser.add_argument('-e', required=False, type=float, default=0, metavar='error_rate', dest='error_rate', help='[e] to select the fraction of failing requests, default=0')
+    parser.add_argument('-d', required=False, metavar='dump_file', dest='dump_file', help='[d] to write the annotations of the publications to a dump file for ingest_annotations.py instead of serving them')
+    parser.add_argument('-p', required=False, type=int, default=8080, metavar='port', dest='port', help='[p] to select the port, default=8080')
+    arguments = parser.parse_args()
+    return arguments
+
+def main():
+    args = parser()
+    if args.results_file:
+        corpus = recorded_corpus(args.results_file)
+    else:
+        corpus = synthetic_corpus(args.size)
+
+    if args.dump_file:
+        write_dump(corpus, args.dump_file)
+        print('annotations of %d publications are written to %s' % (len(corpus), args.dump_file))
+        return
+
+    mock = MockEuropePMC(corpus, latency=args.latency, jitter=args.latency, error_rate=args.error_rate, search_latency=args.search_latency)
+    url = mock.start(args.port)
+    print('serving %d publications at %s (stop with ctrl+c)' % (len(corpus), url))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock.stop()
+        print(dict(mock.stats))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+import gc
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from class_index import CLASS_KEY, ClassIndex, write_index, index_file
+
+# Folder of the compiled property store. It is not kept in the 'files' folder, because every file in there is read as a property file.
+STORE_FOLDER = 'properties'
+
+def read_property_file(path):
+    '''
+    This function reads one property file from the files folder, and returns its information as a pandas series with the (integer) ChEBI ID as index.
+    The .pkl files hold a dataframe with "ChEBI" and "Info" columns, the other files are tab-separated without header.
+    '''
+    if '.pkl' in path:
+        df = pd.read_pickle(path)
+        df['ChEBI'] = df['ChEBI'].astype(int)
+        df = df.set_index('ChEBI')
+    else:
+        df = pd.read_csv(path, sep='\t', header=None, names=['ChEBI', 'Info'], index_col='ChEBI', dtype={"ChEBI": "int", "Info": "str"})
+    return df['Info']
+
+def property_kind(info):
+    '''
+    This function tells how a property is stored: 'list' for lists of ChEBI ID's (e.g. Class), 'number' when every value is a number or "-" (e.g. Mass, logP, idf),
+    and 'text' otherwise (e.g. Names).
+    '''
+    values = info.dropna()
+    if len(values) > 0 and isinstance(values.iloc[0], (list, tuple, np.ndarray)):
+        return 'list'
+    values = values[values != '-']
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.notna().all():
+        return 'number'
+    return 'text'
+
+def compile_property(info, kind, size):
+    '''
+    This function turns the information of one property into dense arrays with the ChEBI ID as position, and returns them in a dictionary of named arrays.
+    Every property has a 'present' array that tells which ChEBI ID's have a value.
+        - number: 'values' (float, NaN for "-" and missing ChEBI ID's)
+        - text: the utf-8 encoded texts one after another in 'data', the text of a ChEBI ID runs from 'offsets'[id] up to 'offsets'[id+1]
+        - list: the ChEBI ID's of all lists one after another in 'data' (integers), with 'offsets' like for text
+    '''
+    # An empty field is no value, and a ChEBI ID that occurs twice keeps its last value, like in a dictionary
+    info = info.dropna()
+    info = info[~info.index.duplicated(keep='last')].sort_index()
+    ids = info.index.to_numpy()
+    present = np.zeros(size, dtype=bool)
+    present[ids] = True
+
+    if kind == 'number':
+        values = np.full(size, np.nan)
+        values[ids] = pd.to_numeric(info.replace('-', np.nan), errors='coerce').to_numpy(dtype=float)
+        return {'present': present, 'values': values}
+
+    if kind == 'text':
+        items = [str(text).encode('utf-8') for text in info.to_numpy()]
+        data = np.frombuffer(b''.join(items), dtype=np.uint8)
+    else:
+        items = [np.asarray(id_list, dtype=np.int64) for id_list in info.to_numpy()]
+        data = np.concatenate(items) if items else np.zeros(0, dtype=np.int64)
+        data = data.astype(np.int32)
+
+    lengths = np.zeros(size, dtype=np.int64)
+    lengths[ids] = [len(item) for item in items]
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return {'present': present, 'offsets': offsets, 'data': data}
+
+def source_files(files_folder):
+    '''
+    This function returns the property files in the files folder, with their size and modification time, to tell whether the store is up to date.
+    '''
+    files = dict()
+    for file in sorted(os.listdir(files_folder)):
+        stat = os.stat(os.path.join(files_folder, file))
+        files[file] = [stat.st_size, stat.st_mtime]
+    return files
+
+def compile_store(files_folder='files', store_folder=STORE_FOLDER):
+    '''
+    This function compiles all property files in the files folder into a property store: one .npy file per array (see 'compile_property'),
+    and a store.json file with the kind of every property and the property files it was made from. The Class property also gets a class index (see class_index.py).
+    The property name is taken from the file name like in make_table.py (e.g. "Names" for ChEBI2Names_<release>.tsv).
+    '''
+    if not os.path.isdir(store_folder):
+        os.makedirs(store_folder)
+
+    infos = dict()
+    for file in sorted(os.listdir(files_folder)):
+        key = file.split('2')[1].split('_')[0]
+        infos[key] = read_property_file(os.path.join(files_folder, file))
+    size = max([int(info.index.max()) + 1 for info in infos.values() if len(info) > 0] + [1])
+
+    kinds = dict()
+    for key, info in infos.items():
+        kinds[key] = property_kind(info)
+        arrays = compile_property(info, kinds[key], size)
+        for name, array in arrays.items():
+            np.save(os.path.join(store_folder, '%s.%s.npy' % (key, name)), array)
+        if key == CLASS_KEY and kinds[key] == 'list':
+            write_index(store_folder, arrays['offsets'], arrays['data'])
+
+    with open(os.path.join(store_folder, 'store.json'), 'w') as f:
+        json.dump({'size': size, 'kinds': kinds, 'sources': source_files(files_folder)}, f, indent=4)
+
+class PropertyStore:
+    '''
+    This class gives access to a compiled property store. The arrays are memory-mapped, so opening the store takes milliseconds and only the
+    parts that are looked up are read from disk. Lookups take an array of ChEBI ID's and return one value per ChEBI ID, NaN where there is no value.
+    '''
+
+    def __init__(self, store_folder=STORE_FOLDER):
+        with open(os.path.join(store_folder, 'store.json'), 'r') as f:
+            meta = json.load(f)
+        self.folder = store_folder
+        self.size = meta['size']
+        self.kinds = meta['kinds']
+        self.sources = meta['sources']
+        self.arrays = dict()
+        for key, kind in self.kinds.items():
+            names = ['present', 'values'] if kind == 'number' else ['present', 'offsets', 'data']
+            # np.asarray keeps the memory map, but slicing a plain array is much faster than slicing a memmap object
+            self.arrays[key] = {name: np.asarray(np.load(os.path.join(store_folder, '%s.%s.npy' % (key, name)), mmap_mode='r')) for name in names}
+        self.classes = None
+
+    def keys(self):
+        return list(self.kinds.keys())
+
+    def present(self, key, ids):
+        '''
+        This function returns a boolean array that tells for every ChEBI ID whether it has a value for the property.
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        inside = (ids >= 0) & (ids < self.size)
+        present = np.zeros(len(ids), dtype=bool)
+        present[inside] = self.arrays[key]['present'][ids[inside]]
+        return present
+
+    def has_value(self, key, ids):
+        '''
+        This function returns a boolean array that tells for every ChEBI ID whether it has a value for the property other than NaN (e.g. "-" for logP).
+        '''
+        present = self.present(key, ids)
+        if self.kinds[key] == 'number':
+            ids = np.asarray(ids, dtype=np.int64)
+            present[present] = ~np.isnan(self.arrays[key]['values'][ids[present]])
+        return present
+
+    def lookup(self, key, ids):
+        '''
+        This function returns the values of the property for the ChEBI ID's: a float array for numbers, and a list of texts or lists of
+        ChEBI ID's (as strings, like in the Class file) otherwise.
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        present = self.present(key, ids)
+        arrays = self.arrays[key]
+
+        if self.kinds[key] == 'number':
+            values = np.full(len(ids), np.nan)
+            values[present] = arrays['values'][ids[present]]
+            return values
+
+        # Gather the texts or lists of all found ChEBI ID's in one go, and cut them apart afterwards
+        starts = arrays['offsets'][ids[present]]
+        lengths = arrays['offsets'][ids[present] + 1] - starts
+        ends = np.cumsum(lengths)
+        positions = np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) > 0 else 0)
+        gathered = arrays['data'][positions]
+
+        # Millions of new lists would set off the garbage collector over and over, while none of them can be part of a reference cycle
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            if self.kinds[key] == 'text':
+                text = gathered.tobytes()
+                items = [text[end-length:end].decode('utf-8') for end, length in zip(ends.tolist(), lengths.tolist())]
+            else:
+                gathered = list(map(str, gathered.tolist()))
+                items = [gathered[end-length:end] for end, length in zip(ends.tolist(), lengths.tolist())]
+        finally:
+            if collect:
+                gc.enable()
+
+        if present.all():
+            return items
+        values = [float('NaN')] * len(ids)
+        for position, item in zip(np.flatnonzero(present).tolist(), items):
+            values[position] = item
+        return values
+
+    def class_index(self):
+        '''
+        This function opens the class index of the store (see class_index.py) the first time it is needed, and returns it.
+        '''
+        if self.classes == None:
+            if not os.path.isfile(index_file(self.folder, 'member_offsets')):
+                sys.exit('Error: the property store in %s has no class index, run property_store.py again' % self.folder)
+            self.classes = ClassIndex.load(self.folder)
+        return self.classes
+
+    def get(self, key, id):
+        '''
+        This function returns the value of the property for one ChEBI ID, NaN if there is none.
+        '''
+        return self.lookup(key, [id])[0]
+
+def open_store(files_folder='files', store_folder=STORE_FOLDER):
+    '''
+    This function opens the property store, and compiles it first if there is none yet, if the property files changed since it was compiled,
+    or if it was compiled before there was a class index.
+    '''
+    store_file = os.path.join(store_folder, 'store.json')
+    up_to_date = False
+    if os.path.isfile(store_file):
+        with open(store_file, 'r') as f:
+            meta = json.load(f)
+        up_to_date = meta['sources'] == json.loads(json.dumps(source_files(files_folder)))
+        if CLASS_KEY in meta['kinds'] and not os.path.isfile(index_file(store_folder, 'member_offsets')):
+            up_to_date = False
+    if not up_to_date:
+        print('compiling the property store from the %s folder...' % files_folder)
+        compile_store(files_folder, store_folder)
+    return PropertyStore(store_folder)
+
+def parser():
+    parser = argparse.ArgumentParser(description='This script compiles the property files of the files folder into a memory-mapped property store for make_table.py')
+    parser.add_argument('-i', required=False, default='files', metavar='files_folder', dest='files_folder', help='[i] to select the folder with property files, default=files')
+    parser.add_argument('-o', required=False, default=STORE_FOLDER, metavar='store_folder', dest='store_folder', help='[o] to select the property store folder, default=%s' % STORE_FOLDER)
+    arguments = parser.parse_args()
+    return arguments
+
+def main():
+    args = parser()
+    if not os.path.isdir(args.files_folder):
+        sys.exit('Error: folder %s not found, run download_files.py first' % args.files_folder)
+    compile_store(args.files_folder, args.store_folder)
+    store = PropertyStore(args.store_folder)
+    print('property store with %s for %d ChEBI ID\'s is written to %s' % (', '.join(store.keys()), store.size, args.store_folder))
+
+if __name__ == '__main__':
+    main()
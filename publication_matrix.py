@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from compact_results import read_compact
+
+def matrix_file(term):
+    '''
+    This function returns the file of the chemical x publication matrix of a term, next to its table (e.g. tables/HILIC_matrix.npz).
+    '''
+    return 'tables/'+str(term)+'_matrix.npz'
+
+def read_pairs(result, chunk_size=1000000):
+    '''
+    This function reads the (ChEBI ID, publication) rows of a results file (.tsv) or compact results file (.npz), and returns the ChEBI ID's, the position of the
+    publication in the list of publications and the number of mentions of every row, and the list of publications.
+    A .tsv file is read in chunks, and every publication ID is kept once.
+    '''
+    if result.endswith('.npz'):
+        columns = read_compact(result)
+        return columns['chebi'].astype(np.int64), columns['pub'].astype(np.int64), columns['mention_count'].astype(np.int64), columns['publications']
+
+    pub_to_index = dict()
+    chebi, pub = [], []
+    try:
+        chunks = pd.read_csv(result, sep='\t', header=None, dtype={0: "int64", 1: "str"}, chunksize=chunk_size)
+    except pd.errors.EmptyDataError:
+        # an empty results file has no rows
+        chunks = []
+    for chunk in chunks:
+        codes, uniques = pd.factorize(chunk[1])
+        # positions of the publications of this chunk in the list of all publications
+        positions = np.array([pub_to_index.setdefault(pub_id, len(pub_to_index)) for pub_id in uniques], dtype=np.int64)
+        chebi.append(chunk[0].to_numpy())
+        pub.append(positions[codes])
+    chebi = np.concatenate(chebi) if chebi else np.zeros(0, dtype=np.int64)
+    pub = np.concatenate(pub) if pub else np.zeros(0, dtype=np.int64)
+    return chebi, pub, np.ones(len(chebi), dtype=np.int64), np.array(list(pub_to_index.keys()), dtype=str)
+
+def build_matrix(result):
+    '''
+    This function makes the chemical x publication matrix of a results file. It returns the matrix (scipy CSR, with the number of mentions of a chemical in a
+    publication as value), the ChEBI ID of every row (sorted) and the publication ID of every column.
+    '''
+    chebi, pub, mentions, publications = read_pairs(result)
+    chebi_ids, rows = np.unique(chebi, return_inverse=True)
+    # duplicate (row, column) pairs are added up when the matrix is turned into CSR
+    matrix = scipy.sparse.coo_matrix((mentions, (rows, pub)), shape=(len(chebi_ids), len(publications))).tocsr()
+    matrix.sum_duplicates()
+    return matrix, chebi_ids, publications
+
+def save_matrix(file, matrix, chebi_ids, publications):
+    np.savez_compressed(file, indptr=matrix.indptr, indices=matrix.indices, data=matrix.data, shape=np.array(matrix.shape), chebi=chebi_ids, publications=publications)
+
+def load_matrix(file):
+    '''
+    This function reads a matrix file, and returns the matrix, the ChEBI ID of every row and the publication ID of every column.
+    '''
+    with np.load(file, allow_pickle=False) as npz:
+        matrix = scipy.sparse.csr_matrix((npz['data'], npz['indices'], npz['indptr']), shape=tuple(npz['shape']))
+        return matrix, npz['chebi'], npz['publications']
+
+def papers(matrix):
+    '''
+    This function returns the number of distinct publications of every chemical (row) of the matrix.
+    '''
+    return np.diff(matrix.indptr)
+
+def local_idf(matrix):
+    '''
+    This function returns the inverse document frequency of every chemical within the publications of the matrix: log(publications / publications of the chemical).
+    Unlike the idf of the files folder, which is taken over all of Europe PMC, this tells how specific a chemical is for the query.
+    '''
+    return np.log(matrix.shape[1] / papers(matrix))
+
+def cooccurrence(matrix):
+    '''
+    This function returns a square matrix (scipy CSR) with the number of publications that every two chemicals share. The diagonal holds the number of
+    publications of every chemical.
+    '''
+    binary = (matrix > 0).astype(np.int32)
+    return (binary @ binary.T).tocsr()
+
+def cooccurring(matrix, chebi_ids, chebi_id, number=20):
+    '''
+    This function returns the chemicals that share the most publications with one chemical, as a dataframe (ChEBI ID as index, "Shared" as column).
+    '''
+    row = np.searchsorted(chebi_ids, chebi_id)
+    if row == len(chebi_ids) or chebi_ids[row] != chebi_id:
+        return pd.DataFrame({'Shared': []}, index=pd.Index([], name='ChEBI'))
+    binary = (matrix > 0).astype(np.int32)
+    shared = np.asarray((binary @ binary[row].T).todense()).ravel()
+    shared[row] = 0
+    top = np.argsort(-shared, kind='stable')[:number]
+    top = top[shared[top] > 0]
+    return pd.DataFrame({'Shared': shared[top]}, index=pd.Index(chebi_ids[top], name='ChEBI'))
+
+def parser():
+    parser = argparse.ArgumentParser(description='This script summarizes a chemical x publication matrix that make_table.py made with -m')
+    parser.add_argument('-i', required=True, metavar='matrix_file', dest='matrix_file', help='[i] to select the matrix file (tables/<term>_matrix.npz)')
+    parser.add_argument('-c', required=False, type=int, metavar='chebi_id', dest='chebi_id', help='[c] to list the chemicals that share the most publications with a chemical')
+    parser.add_argument('-n', required=False, type=int, default=20, metavar='number', dest='number', help='[n] to select the number of chemicals to list, default=20')
+    arguments = parser.parse_args()
+    return arguments
+
+def main():
+    args = parser()
+    if not os.path.isfile(args.matrix_file):
+        sys.exit('Error: matrix file %s not found, run make_table.py with -m first' % args.matrix_file)
+    matrix, chebi_ids, publications = load_matrix(args.matrix_file)
+    print('%d chemicals x %d publications, %d (chemical, publication) pairs' % (matrix.shape[0], matrix.shape[1], matrix.nnz))
+
+    if args.chebi_id != None:
+        print(cooccurring(matrix, chebi_ids, args.chebi_id, args.number))
+    else:
+        df = pd.DataFrame({'Papers': papers(matrix), 'local idf': local_idf(matrix)}, index=pd.Index(chebi_ids, name='ChEBI'))
+        print(df.sort_values(by='Papers', ascending=False).head(args.number))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+import math
+import random
+import hashlib
+import threading
+
+# Ways to select the publications of a sampling harvest (see 'Sampler')
+SAMPLING_METHODS = ['random', 'stratified']
+
+# z-value of a 95% confidence interval
+Z_95 = 1.96
+
+def sample_size_for_error(error, population):
+    '''
+    This function returns the number of publications to sample from a population of publications, so that the share of publications with a property
+    (e.g. a chemical in one hexagon of the plot) is estimated within 'error' (e.g. 0.01 for 1 percent point) with 95% confidence.
+    The worst case share of 0.5 is used, with the correction for sampling from a finite population.
+    '''
+    if population <= 0:
+        return 0
+    size = Z_95**2 * 0.25 / error**2
+    return min(population, math.ceil(size / (1 + (size - 1) / population)))
+
+class Sampler:
+    '''
+    This class selects the publications that are annotated in a sampling harvest, a fraction of the publications of every search page.
+        - random: a publication is selected when a hash of its ID (and the seed) falls below the fraction. Every publication has the same chance, and the same
+          publications are selected again when a search is continued with --resume or divided in shards.
+        - stratified: every search page gets its share of the sample (the fraction of its publications, with the remainder carried over to the next page),
+          chosen at random within the page. The sample then follows the hit list evenly, and its size is exactly the fraction of the publications.
+    The harvest runs in several threads, so the counts are kept under a lock.
+    '''
+
+    def __init__(self, fraction, method='random', seed=0):
+        self.fraction = fraction
+        self.method = method
+        self.seed = seed
+        self.carry = 0.0
+        self.seen = 0
+        self.selected = 0
+        self.lock = threading.Lock()
+
+    def keep(self, pub_id):
+        digest = hashlib.sha1(('%s:%s' % (self.seed, pub_id)).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') < self.fraction * 2**64
+
+    def select(self, publications):
+        '''
+        This function recieves the publications of a search page (tuples of publication ID and source) and returns the ones to annotate.
+        '''
+        if self.method == 'random':
+            selected = [publication for publication in publications if self.keep(publication[0])]
+        else:
+            with self.lock:
+                share = self.fraction * len(publications) + self.carry
+                number = min(len(publications), int(share))
+                self.carry = share - number
+            rng = random.Random('%s:%s' % (self.seed, publications[0][0] if publications else ''))
+            selected = [publications[i] for i in sorted(rng.sample(range(len(publications)), number))]
+
+        with self.lock:
+            self.seen += len(publications)
+            self.selected += len(selected)
+        return selected
+
+    def sampled_fraction(self):
+        '''
+        This function returns the share of the publications that ended up in the sample. For a random sample it differs a little from the fraction that
+        was aimed for, and scaling the counts with it keeps the chance of a larger or smaller sample out of the estimates.
+        '''
+        return self.selected / self.seen if self.seen > 0 else self.fraction
+
+    def summary(self):
+        return {'method': self.method, 'fraction': self.fraction, 'sampled fraction': self.sampled_fraction(), 'seed': self.seed, 'publications seen': self.seen,
+            'publications sampled': self.selected}
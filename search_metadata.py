@@ -0,0 +1,48 @@
+#!/usr/bin/python
+
+import os
+import datetime
+
+def write_metadata(term, query, number_of_papers, number_of_chemicals, number_of_unique_chemicals, search_date=None):
+    """
+    This function writes the metadata of the search to a text file, with today as search date unless another search date is given.
+    """
+
+    current_day = datetime.date.today() if search_date == None else search_date
+
+    file = 'metadata/'+str(term)+'.txt'
+    f = open(file, 'w')
+    f.write('metadata for %s\n' % term
+    + 'query: %s\n' % query
+    + 'search date: %s\n' % current_day
+    + 'number of papers: %d\n' % number_of_papers
+    + 'number of chemicals: %d\n' % number_of_chemicals
+    + 'number of unique chemicals: %d (note: not all chemicals can be plotted due to missing logP values)' % number_of_unique_chemicals )
+
+def read_metadata(term):
+    """
+    This function reads the metadata file of the term and returns its lines in a dictionary (e.g. 'query' and 'search date' as keys).
+    If there is no metadata file, an empty dictionary is returned.
+    """
+
+    file = 'metadata/'+str(term)+'.txt'
+    metadata = dict()
+    if not os.path.isfile(file):
+        return metadata
+
+    with open(file, 'r') as f:
+        for line in f.readlines()[1:]:
+            key, value = line.split(': ', 1)
+            metadata[key] = value.strip()
+
+    return metadata
+
+def write_sampling(term, sampler):
+    """
+    This function adds the sampling fraction (the share of the publications that was sampled) and the size of the sample to the metadata file of the term.
+    """
+
+    file = 'metadata/'+str(term)+'.txt'
+    with open(file, 'a') as f:
+        f.write('\nsampling fraction: %.6g' % sampler.sampled_fraction()
+        + '\nsampling method: %s sample of %d of %d publications with text mined terms (seed %d)' % (sampler.method, sampler.selected, sampler.seen, sampler.seed))
@@ -1,7 +1,6 @@
 #!/usr/bin/python
 
 import argparse
-import urllib.request
 import urllib.parse
 import json
 import concurrent.futures
@@ -9,143 +8,830 @@ import csv
 import time
 import datetime
 import math
+import requests
+import asyncio
+import collections
+import os
+import sys
+import random
+import threading
+import functools
+import re
+import multiprocessing
+import http_client
+from annotation_cache import AnnotationCache, cache_report
+from compact_results import write_compact
+from search_metadata import read_metadata, write_metadata, write_sampling
+from harvest_stats import HarvestStats
+from sampling import Sampler, SAMPLING_METHODS, sample_size_for_error
+
+# Base url of the Europe PMC apis (replaced by the url of mock_europepmc in benchmark_harvest)
+EUROPE_PMC = "https://www.ebi.ac.uk/europepmc"
+
+# Query filter that lets Europe PMC select the publications with text mined terms (see 'filter_query')
+TMT_FILTER = "HAS_TM:Y"
+
+# Process pool that parses the annotation downloads (see 'start_parse_pool'), None to parse them in the download threads
+PARSE_POOL = None
 
 def construct_url(query, pageSize, cursorMark):
     """
     This function constructs a url that searches through the europepmc website and returns the results in json format.
+    If the query already selects publications with text mined terms (see 'filter_query'), the smallest result type (idlist: only ID's and sources) is asked for,
+    otherwise the lite result type, which tells for every publication whether it has text mined terms.
     """
 
     query_string = urllib.parse.quote(query)
+    resultType = "idlist" if TMT_FILTER in query else "lite"
 
-    url = "https://www.ebi.ac.uk/europepmc/webservices/rest/search?query=" + query_string + "&pageSize=" + str(pageSize) + "&resultType=lite&format=JSON&cursorMark=" + str(cursorMark)
+    url = EUROPE_PMC + "/webservices/rest/search?query=" + query_string + "&pageSize=" + str(pageSize) + "&resultType=" + resultType + "&format=JSON&cursorMark=" + str(cursorMark)
 
     return url
 
 
-def get_data(url, timeout, sleep_time):
+def construct_annotation_url(publications):
+    """
+    This function constructs a url that returns the annotations of one or more publications in json format.
+    The publications are given as a list of (publication ID, source) tuples, and are joined in a comma-separated list of article IDs.
+    """
+
+    article_ids = ",".join(str(source) + ":" + str(id) for id, source in publications)
+    url = EUROPE_PMC + "/annotations_api/annotationsByArticleIds?articleIds=" + article_ids + "&format=JSON"
+
+    return url
+
+
+def batch_publications(publications, batch_size):
+    """
+    This function divides the list of publications in batches of at most 'batch_size' publications, so that one url can be constructed per batch.
+    """
+
+    return [publications[i:i+batch_size] for i in range(0, len(publications), batch_size)]
+
+
+class DownloadError(Exception):
+    """
+    This error is raised by 'get_data' when a url cannot be downloaded: after the maximum number of attempts, or right away for a HTTP error that will not go away by retrying (e.g. 404).
+    """
+    pass
+
+
+class AdaptiveLimiter:
     """
-    This function recieves a url and returns the json data as type dictionary.
-    If there is no response within the given timeout, an error message is printed and the connection is retried after the given sleep time.
+    This class limits the number of simultaneous downloads, and adapts the limit to the observed errors.
+    After a failure (timeout, HTTP 429/5xx, connection error) the limit is halved, and it grows back by one connection per 'limit' successful downloads, up to the maximum.
+    Failures within one second of a decrease count as one, so a burst of failed connections does not bring the limit down to 1 at once.
     """
-    connection = False
-    while connection == False:
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def success(self):
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + 1/self.limit)
+            self.condition.notify_all()
+
+    def failure(self):
+        with self.condition:
+            now = time.monotonic()
+            if now - self.last_decrease > 1:
+                self.limit = max(1, self.limit/2)
+                self.last_decrease = now
+
+
+def classify_error(error):
+    """
+    This function recieves the error of a failed download and returns its cause, together with the 'Retry-After' header of the response (or None).
+    HTTP errors other than 429 (too many requests) and 5xx (server errors) are not worth retrying, for these a DownloadError is raised.
+    """
+
+    if isinstance(error, requests.HTTPError):
+        code = error.response.status_code
+        if code != 429 and code < 500:
+            raise DownloadError('HTTP %d' % code)
+        return 'HTTP %d' % code, error.response.headers.get('Retry-After')
+    if isinstance(error, json.JSONDecodeError):
+        return 'malformed json', None
+    if isinstance(error, requests.Timeout):
+        return 'timeout', None
+    return 'connection error', None
+
+
+def backoff_time(attempt, sleep_time, max_sleep_time, retry_after=None):
+    """
+    This function returns the number of seconds to wait before the next attempt.
+    The sleep time doubles with every attempt up to 'max_sleep_time', and is spread randomly between half and the full value (jitter), so that failed connections are not retried all at the same moment.
+    If the server asked to wait with a 'Retry-After' header, that time is used instead.
+    """
+
+    if retry_after != None and retry_after.isdigit():
+        return min(max_sleep_time, int(retry_after))
+
+    sleep = min(max_sleep_time, sleep_time * 2**(attempt-1))
+    return random.uniform(sleep/2, sleep)
+
+
+def get_data(url, timeout, sleep_time, max_attempts=10, limiter=None, stats=None, parse=json.loads):
+    """
+    This function recieves a url and returns the json data as type dictionary, or what the 'parse' function makes of the downloaded bytes instead.
+    If the download fails (timeout, HTTP 429/5xx, connection error or malformed json), the cause is printed and the download is retried after an exponentially growing sleep time (see 'backoff_time').
+    After 'max_attempts' attempts, or for other HTTP errors, a DownloadError is raised.
+    If a limiter is given, the download waits for a free connection and reports its success or failure to the limiter.
+    The download goes over the shared keep-alive session of 'http_client', so open connections are reused.
+    If harvest stats are given, the latency and size of the download and every retry and failure are recorded in them.
+    """
+    MAX_SLEEP_TIME = 300
+    endpoint = 'search' if '/rest/search' in url else 'annotations'
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if limiter != None:
+            limiter.acquire()
         try:
-            response = urllib.request.urlopen(url, timeout=timeout)
-            data = json.loads(response.read())
-            connection = True
-        except:
-            print('connection failed')
-            time.sleep(sleep_time) # in seconds
-    return data
+            start = time.perf_counter()
+            response = http_client.get(url, timeout=timeout)
+            response.raise_for_status()
+            data = parse(response.content)
+            if limiter != None:
+                limiter.success()
+            if stats != None:
+                size = int(response.headers.get('Content-Length') or len(response.content))
+                stats.request(endpoint, time.perf_counter() - start, size, len(response.content))
+            return data
+        except (requests.RequestException, ValueError) as error:
+            try:
+                cause, retry_after = classify_error(error)
+            except DownloadError as download_error:
+                if stats != None:
+                    stats.failure(str(download_error))
+                raise DownloadError('%s could not be downloaded (%s)' % (url, download_error))
+            if limiter != None and cause != 'malformed json':
+                limiter.failure()
+        finally:
+            if limiter != None:
+                limiter.release()
+
+        if attempt >= max_attempts:
+            if stats != None:
+                stats.failure(cause)
+            raise DownloadError('%s could not be downloaded after %d attempts (%s)' % (url, attempt, cause))
+        sleep = backoff_time(attempt, sleep_time, MAX_SLEEP_TIME, retry_after)
+        if stats != None:
+            stats.retry(cause)
+        print('connection failed (%s), retrying in %.0f seconds' % (cause, sleep))
+        time.sleep(sleep) # in seconds
 
 
 def find_publications_with_tmt(data):
     """
     This function looks for publications with text mined terms.
     It returns a list of tuples with the publication ID as the first value and the publication source as the second value.
+    Publications of the idlist result type have no 'hasTextMinedTerms', these come from a query that only selects publications with text mined terms.
     """
 
     page = []
     for publication in data['resultList']['result']:
-        if publication['hasTextMinedTerms'] == 'Y':
+        if publication.get('hasTextMinedTerms', 'Y') == 'Y':
             publication = (publication['id'], publication['source'])
             page.append(publication)
 
     return page
 
 
-def search_publications(query, pageSize):
+def search_publications(query, pageSize, batch_size=1, checkpoint=None, cache=None, writer=None, stats=None, sampler=None):
     """
     This function searches the europe pmc site with the query and retrieves all hits (publications).
     Variable 'CursorMark' is used to go through the search result pages until all publcations are retrieved.
     Publications are selected for having text mined terms with function 'find_publications_with_tmt'.
-    Their annotations are downloaded with function 'get_annotations' and saved in a dictionary with publication id as key and chemical ids in a list as value.
+    Their annotations are downloaded with function 'get_annotations' (in batches of 'batch_size' publications per request) and saved in a dictionary with publication id as key and chemical ids in a list as value.
+    If a checkpoint journal is given, the search continues where the journal stopped, and every finished page is added to the journal.
+    If an annotation cache is given, publications found in the cache are not downloaded again.
+    If a results writer is given, every page is written to the results file right away, and the returned dictionary stays empty.
+    If harvest stats are given, all downloads and pages are recorded in them, and the throughput is printed with every page.
+    If a sampler is given, only the publications it selects are annotated (see sampling.py).
     After the search is done, this dictionary is returned.
     """
-    chebi_dict = dict()
     TIMEOUT=60
     SLEEP_TIME=5
+    CONNECTIONS=10
 
     print("searching publications...")
-    cursorMark = "*"
-    pages = []
-    url = construct_url(query, pageSize, cursorMark)
-    query_data = get_data(url, TIMEOUT, SLEEP_TIME)
-    total_hits = query_data['hitCount']
-    print("total hits: %d" % total_hits)
-
-    try:
-        nextCursorMark = query_data['nextCursorMark']
-    except:
-        nextCursorMark = None
-    publications = find_publications_with_tmt(query_data)
-    chebi_dict = get_annotations(publications, chebi_dict)
-
-    counter = 1
-    while nextCursorMark != None:
-
-        print('%d/%d pages retrieved' % (counter, math.ceil(total_hits/1000)))
+    counter, cursorMark, chebi_dict, harvested = read_checkpoint(checkpoint)
+    limiter = AdaptiveLimiter(CONNECTIONS)
 
-        cursorMark = nextCursorMark
+    while cursorMark != None:
         url = construct_url(query, pageSize, cursorMark)
-        query_data = get_data(url, TIMEOUT, SLEEP_TIME)
+        query_data = get_data(url, TIMEOUT, SLEEP_TIME, stats=stats)
+        total_hits = query_data['hitCount']
+        if counter == 0:
+            print("total hits: %d" % total_hits)
+
         try:
             nextCursorMark = query_data['nextCursorMark']
         except:
             nextCursorMark = None
-        publications = find_publications_with_tmt(query_data)
-        chebi_dict = get_annotations(publications, chebi_dict)
+        publications = [publication for publication in find_publications_with_tmt(query_data) if publication[0] not in harvested]
+        if sampler != None:
+            publications = sampler.select(publications)
+        page_dict = get_annotations(publications, dict(), batch_size, cache, limiter, stats)
 
         counter += 1
+        chebi_dict = finish_page(chebi_dict, page_dict, checkpoint, counter, nextCursorMark, publications, writer)
+        print_progress(counter, total_hits, pageSize, publications, stats)
+
+        cursorMark = nextCursorMark
 
     return chebi_dict
 
 
-def get_annotations(publications, dict):
+def print_progress(counter, total_hits, pageSize, publications, stats=None):
+    """
+    This function prints the number of retrieved pages, with the throughput so far if harvest stats are given, and records the page in the stats.
+    """
+
+    if stats == None:
+        print('%d/%d pages retrieved' % (counter, math.ceil(total_hits/pageSize)))
+        return
+
+    stats.page(len(publications))
+    print('%d/%d pages retrieved (%s)' % (counter, math.ceil(total_hits/pageSize), stats.progress()))
+
+
+def checkpoint_file(term):
+    """
+    This function returns the path of the checkpoint journal for the query term, in the 'checkpoints' folder.
+    """
+
+    if not os.path.isdir('checkpoints'):
+        os.mkdir('checkpoints')
+
+    return 'checkpoints/'+str(term)+'.jsonl'
+
+
+def start_checkpoint(file, query, stream=False):
+    """
+    This function starts a new (empty) checkpoint journal for the query. An existing journal is overwritten.
+    The header tells whether the results are streamed to the results file (see 'checkpoint_offset').
+    """
+
+    with open(file, 'w') as f:
+        f.write(json.dumps({'query': query, 'stream': stream}) + '\n')
+
+
+def write_checkpoint(file, counter, cursorMark, publications, page_dict, offset=None):
+    """
+    This function adds a finished page to the checkpoint journal as one json line: the page counter, the cursorMark of the next page,
+    the ID's of the publications on the page and their ChEBI ID's. The line is flushed to disk right away, so the journal survives a crash.
+    When the results are streamed to the results file, the ChEBI ID's are left out and the size of the results file after the page is recorded instead.
+    """
+
+    record = {'page': counter, 'cursorMark': cursorMark, 'publications': [publication[0] for publication in publications], 'annotations': page_dict}
+    if offset != None:
+        record['offset'] = offset
+    with open(file, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_checkpoint(file):
+    """
+    This function reads the checkpoint journal and returns the state to continue the search from:
+    the number of finished pages, the cursorMark of the next page, the dictionary with ChEBI ID's so far and the set of finished publication ID's.
+    Without a journal (or with a new one), the search starts at the first page. A last line that was cut off by a crash is ignored.
+    """
+
+    counter = 0
+    cursorMark = "*"
+    chebi_dict = dict()
+    harvested = set()
+
+    if file == None:
+        return counter, cursorMark, chebi_dict, harvested
+
+    with open(file, 'r') as f:
+        lines = f.readlines()
+
+    for line in lines[1:]:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            break
+        counter = record['page']
+        cursorMark = record['cursorMark']
+        chebi_dict = merge_annotations(chebi_dict, record['annotations'])
+        harvested.update(record['publications'])
+
+    if counter > 0:
+        print('resuming after page %d (%d publications already harvested)' % (counter, len(harvested)))
+
+    return counter, cursorMark, chebi_dict, harvested
+
+
+def checkpoint_offset(file):
+    """
+    This function returns the size of the results file after the last page in the checkpoint journal (0 if no page is finished yet).
+    If the journal was not made while streaming results, None is returned.
+    """
+
+    with open(file, 'r') as f:
+        lines = f.readlines()
+
+    if not json.loads(lines[0]).get('stream', False):
+        return None
+
+    offset = 0
+    for line in lines[1:]:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            break
+        offset = record['offset']
+
+    return offset
+
+
+def checkpoint_query(file):
+    """
+    This function returns the query that the checkpoint journal was started for.
+    """
+
+    with open(file, 'r') as f:
+        header = json.loads(f.readline())
+
+    return header['query']
+
+
+def finish_page(chebi_dict, page_dict, checkpoint, counter, cursorMark, publications, writer=None):
+    """
+    This function adds the ChEBI ID's of a finished page to the dictionary and, if a checkpoint journal is given, records the page in the journal.
+    If a results writer is given, the ChEBI ID's are written to the results file instead, and the dictionary stays empty.
+    """
+
+    offset = None
+    if writer != None:
+        offset = writer.write_page(page_dict)
+        page_dict = dict()
+    else:
+        chebi_dict = merge_annotations(chebi_dict, page_dict)
+
+    if checkpoint != None:
+        write_checkpoint(checkpoint, counter, cursorMark, publications, page_dict, offset)
+
+    return chebi_dict
+
+
+def get_annotations(publications, dict, batch_size=1, cache=None, limiter=None, stats=None):
     """
     This function searches through the publications with text mined terms for annotations of type 'Chemicals'.
     From the ChEBI urls, the ChEBI ID's are extracted and returned as values with the publication ID's as keys in a dictionary.
+    With a 'batch_size' larger than 1, the annotations of that many publications are requested with one url.
+    If an annotation cache is given, cached publications are not downloaded, and downloaded publications are added to the cache.
+    The number of simultaneous connections is adapted to the error rate by the limiter, which should be shared by all pages of a search.
     """
 
-    # Construct urls to the annotation data for every publications
+    # Take the cached publications from the cache, only the others are downloaded
+    if cache != None:
+        cached, publications = cache.lookup(publications, stats)
+        dict = merge_annotations(dict, cached)
+
+    # Construct urls to the annotation data for every batch of publications
     urls = []
-    for publication in publications:
-        id = publication[0]
-        source = publication[1]
-        url = "https://www.ebi.ac.uk/europepmc/annotations_api/annotationsByArticleIds?articleIds=" + str(source) + ":" + str(id) + "&format=JSON"
+    for batch in batch_publications(publications, batch_size):
+        url = construct_annotation_url(batch)
         urls.append(url)
 
-    json_data = []
+    batch_dicts = []
     CONNECTIONS = 10
     TIMEOUT = 10
-    SLEEP_TIME = 300
+    SLEEP_TIME = 5
+
+    if limiter == None:
+        limiter = AdaptiveLimiter(CONNECTIONS)
 
     # ThreadPoolExecutor allows multiple connections, thereby speeding up the process of downloading annotations
-    with concurrent.futures.ThreadPoolExecutor(max_workers=CONNECTIONS) as executor:
-        future_to_url = (executor.submit(get_data, url, TIMEOUT, SLEEP_TIME) for url in urls)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=limiter.maximum) as executor:
+        future_to_url = (executor.submit(get_data, url, TIMEOUT, SLEEP_TIME, limiter=limiter, stats=stats, parse=parse_chemicals) for url in urls)
         for future in concurrent.futures.as_completed(future_to_url):
-            data = future.result()
-            json_data.append(data)
-
-    # Select the downloaded annotations for type 'Chemicals' and extract ChEBI ID
-    for data in json_data:
-        if len(data) > 0:
-            annotations = data[0]['annotations']
-            pub_id = data[0]['extId']
-            for annotation in annotations:
-                if annotation['type'] == 'Chemicals':
-                    chebi_url = annotation['tags'][0]['uri']
-                    chebi_id = chebi_url.split('_')[1]
-
-                    # Check if publication ID is already in dictionary, if not, then a list as value needs to be created for potentially multiple chebi id's per publication
-                    try:
-                        dict[pub_id]
-                        dict[pub_id].append(chebi_id)
-                    except:
-                        dict[pub_id] = [chebi_id]
+            batch_dicts.append(future.result())
+
+    # The annotations of type 'Chemicals' are already selected by 'parse_chemicals', only the publications of the batches are put together here
+    downloaded = {}
+    for batch_dict in batch_dicts:
+        downloaded = merge_annotations(downloaded, batch_dict)
+
+    if cache != None:
+        cache.store(publications, downloaded)
+
+    return merge_annotations(dict, downloaded)
+
+def parse_annotations(data, dict):
+    '''
+    This function recieves the json data of one annotation download and selects the annotations of type 'Chemicals'.
+    The json data is a list with one entry per publication, so a batched download is split back into the separate publications here.
+    From the ChEBI urls, the ChEBI ID's are extracted and added to the dictionary with the publication ID as key.
+    '''
+    for article in data:
+        annotations = article['annotations']
+        pub_id = article['extId']
+        for annotation in annotations:
+            if annotation['type'] == 'Chemicals':
+                chebi_url = annotation['tags'][0]['uri']
+                chebi_id = chebi_url.split('_')[1]
 
+                # Check if publication ID is already in dictionary, if not, then a list as value needs to be created for potentially multiple chebi id's per publication
+                try:
+                    dict[pub_id]
+                    dict[pub_id].append(chebi_id)
+                except:
+                    dict[pub_id] = [chebi_id]
+
+    return dict
+
+def parse_download(content):
+    '''
+    This function parses the downloaded bytes of one annotation download, and returns the ChEBI ID's per publication (see 'parse_annotations').
+    It runs in the processes of the parse pool, so it only takes and returns data that can be sent between processes.
+    '''
+    return parse_annotations(json.loads(content), dict())
+
+def parse_chemicals(content):
+    '''
+    This function parses one annotation download: in the parse pool if there is one, otherwise right here.
+    The download thread waits for the parse pool without holding the GIL, so the other threads keep downloading while the json is parsed on other cores.
+    Malformed json raises the same error in both cases, so the download is retried (see 'get_data').
+    '''
+    if PARSE_POOL == None:
+        return parse_download(content)
+    return PARSE_POOL.submit(parse_download, content).result()
+
+def start_parse_pool(workers):
+    '''
+    This function starts a pool of 'workers' processes that parse the annotation downloads, so that the parsing is spread over several cores.
+    The processes are started fresh (spawn), since forking a process with running download threads is not safe.
+    '''
+    global PARSE_POOL
+    PARSE_POOL = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def merge_annotations(dict, page_dict):
+    '''
+    This function adds the ChEBI ID's of one page of publications to the dictionary with all ChEBI ID's, and returns this dictionary.
+    '''
+    for pub_id, chebi_ids in page_dict.items():
+        if pub_id in dict:
+            dict[pub_id].extend(chebi_ids)
+        else:
+            dict[pub_id] = chebi_ids
     return dict
 
+async def fetch_data(url, timeout, sleep_time, semaphore=None, limiter=None, stats=None, parse=json.loads):
+    '''
+    This function is the asynchronous counterpart of 'get_data'. The download itself runs in the thread pool of the event loop.
+    If a semaphore is given, the download waits for a free connection first, so that the number of open connections stays bounded.
+    The limiter, harvest stats and parse function are passed on to 'get_data', to adapt the number of connections to the error rate, to record the download and to parse it.
+    '''
+    loop = asyncio.get_running_loop()
+    download = functools.partial(get_data, url, timeout, sleep_time, limiter=limiter, stats=stats, parse=parse)
+    if semaphore is None:
+        return await loop.run_in_executor(None, download)
+    async with semaphore:
+        return await loop.run_in_executor(None, download)
+
+async def annotate_page(publications, semaphore, batch_size=1, cache=None, limiter=None, stats=None):
+    '''
+    This function downloads the annotations of one page of publications concurrently, bounded by the semaphore.
+    It returns a dictionary with publication ID's as keys and lists of ChEBI ID's as values, like 'get_annotations', and uses the annotation cache in the same way.
+    '''
+    TIMEOUT = 10
+    SLEEP_TIME = 5
+
+    page_dict = dict()
+    if cache != None:
+        page_dict, publications = cache.lookup(publications, stats)
+
+    urls = [construct_annotation_url(batch) for batch in batch_publications(publications, batch_size)]
+    batch_dicts = await asyncio.gather(*(fetch_data(url, TIMEOUT, SLEEP_TIME, semaphore, limiter, stats, parse_chemicals) for url in urls))
+
+    downloaded = dict()
+    for batch_dict in batch_dicts:
+        downloaded = merge_annotations(downloaded, batch_dict)
+
+    if cache != None:
+        cache.store(publications, downloaded)
+
+    return merge_annotations(page_dict, downloaded)
+
+async def harvest_publications(query, pageSize, connections, batch_size=1, checkpoint=None, cache=None, writer=None, semaphore=None, limiter=None, stats=None, sampler=None):
+    '''
+    This function is the asynchronous version of 'search_publications' and returns the same dictionary, and uses the checkpoint journal, annotation cache, results writer, harvest stats and sampler in the same way.
+    The cursor pages are walked on a connection of their own: as soon as a page is in, the next page is requested
+    while the annotations of the earlier pages are still downloading over at most 'connections' connections.
+    At most PREFETCH_PAGES pages are annotated at the same time, and finished pages are added to the dictionary in page order.
+    When several queries are harvested at the same time, they share the semaphore and limiter (see 'harvest_queries').
+    '''
+    TIMEOUT = 60
+    SLEEP_TIME = 5
+    PREFETCH_PAGES = 2
+
+    if semaphore == None:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=connections+1))
+        semaphore = asyncio.Semaphore(connections)
+        limiter = AdaptiveLimiter(connections)
+    pending = collections.deque()
+
+    print("searching publications...")
+    counter, cursorMark, chebi_dict, harvested = read_checkpoint(checkpoint)
+    search_task = None
+    if cursorMark != None:
+        url = construct_url(query, pageSize, cursorMark)
+        search_task = asyncio.ensure_future(fetch_data(url, TIMEOUT, SLEEP_TIME, stats=stats))
+
+    while search_task != None:
+        query_data = await search_task
+        total_hits = query_data['hitCount']
+        if counter == 0:
+            print("total hits: %d" % total_hits)
+        counter += 1
+
+        # Request the next page right away, before the annotations of this page are downloaded
+        try:
+            nextCursorMark = query_data['nextCursorMark']
+            url = construct_url(query, pageSize, nextCursorMark)
+            search_task = asyncio.ensure_future(fetch_data(url, TIMEOUT, SLEEP_TIME, stats=stats))
+        except KeyError:
+            nextCursorMark = None
+            search_task = None
+
+        publications = [publication for publication in find_publications_with_tmt(query_data) if publication[0] not in harvested]
+        if sampler != None:
+            publications = sampler.select(publications)
+        task = asyncio.ensure_future(annotate_page(publications, semaphore, batch_size, cache, limiter, stats))
+        pending.append((counter, nextCursorMark, publications, task))
+        print_progress(counter, total_hits, pageSize, publications, stats)
+
+        # Wait for the oldest page when too many pages are being annotated
+        while len(pending) > PREFETCH_PAGES:
+            page_counter, page_cursorMark, page_publications, task = pending.popleft()
+            chebi_dict = finish_page(chebi_dict, await task, checkpoint, page_counter, page_cursorMark, page_publications, writer)
+
+    while pending:
+        page_counter, page_cursorMark, page_publications, task = pending.popleft()
+        chebi_dict = finish_page(chebi_dict, await task, checkpoint, page_counter, page_cursorMark, page_publications, writer)
+
+    return chebi_dict
+
+def date_query(query, start, end):
+    '''
+    This function restricts the query to publications with a first publication date from 'start' up to and including 'end'.
+    '''
+    return '(' + query + ') AND (FIRST_PDATE:[' + str(start) + ' TO ' + str(end) + '])'
+
+async def count_hits(query, stats=None, semaphore=None):
+    '''
+    This function returns the number of hits of the query, by requesting a search page with only one publication.
+    If a semaphore is given, the request waits for a free connection first (see 'fetch_data').
+    '''
+    TIMEOUT = 60
+    SLEEP_TIME = 5
+
+    url = construct_url(query, 1, '*')
+    query_data = await fetch_data(url, TIMEOUT, SLEEP_TIME, semaphore, stats=stats)
+    return query_data['hitCount']
+
+async def plan_shards(query, start, end, shard_size, stats=None, semaphore=None):
+    '''
+    This function divides the publication dates from 'start' to 'end' into date ranges (shards) of at most 'shard_size' hits each.
+    The hits of a date range are counted with 'count_hits'; a range with too many hits is split in two halves, which are counted at the same time.
+    A single day is never split, even if it has more hits. It returns a list of (start, end, hits) tuples in date order, without empty ranges.
+    The semaphore bounds the number of ranges that are counted at the same time.
+    '''
+    hits = await count_hits(date_query(query, start, end), stats, semaphore)
+    if hits == 0:
+        return []
+    if hits <= shard_size or start == end:
+        return [(start, end, hits)]
+
+    middle = start + (end - start) / 2
+    first, second = await asyncio.gather(plan_shards(query, start, middle, shard_size, stats, semaphore), plan_shards(query, middle + datetime.timedelta(days=1), end, shard_size, stats, semaphore))
+    return first + second
+
+async def harvest_shards(query, pageSize, connections, shard_size, shards, batch_size=1, cache=None, semaphore=None, limiter=None, stats=None, sampler=None):
+    '''
+    This function harvests a query with many hits in date-range shards, so that several cursor chains are walked at the same time instead of one.
+    The shards are planned with 'plan_shards', and at most 'shards' of them are harvested at the same time with 'harvest_publications', sharing the annotation connections.
+    The dictionaries of the shards are merged in date order. The date ranges do not overlap, but a publication that still shows up in two shards is only kept once.
+    It returns the same dictionary as 'harvest_publications'.
+    '''
+    FIRST_DATE = datetime.date(1800, 1, 1)
+
+    if semaphore == None:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=connections+shards))
+        semaphore = asyncio.Semaphore(connections)
+        limiter = AdaptiveLimiter(connections)
+
+    # Publications can be dated ahead of their appearance, so the last shard runs up to a year from now
+    last_date = datetime.date.today() + datetime.timedelta(days=365)
+    # The hits are counted over the connections of the shards, that are not in use yet
+    counting = asyncio.Semaphore(shards)
+    total_hits, plan = await asyncio.gather(count_hits(query, stats, counting), plan_shards(query, FIRST_DATE, last_date, shard_size, stats, counting))
+    shard_hits = sum(hits for start, end, hits in plan)
+    print('total hits: %d, divided over %d shards' % (total_hits, len(plan)))
+    if shard_hits != total_hits:
+        print('warning: the shards hold %d of the %d hits (publications without a publication date in the range are missed)' % (shard_hits, total_hits))
+
+    running = asyncio.Semaphore(shards)
+
+    async def harvest_shard(start, end):
+        async with running:
+            return await harvest_publications(date_query(query, start, end), pageSize, connections, batch_size, None, cache, None, semaphore, limiter, stats, sampler)
+
+    shard_dicts = await asyncio.gather(*(harvest_shard(start, end) for start, end, hits in plan))
+
+    chebi_dict = dict()
+    for shard_dict in shard_dicts:
+        for pub_id, chebi_ids in shard_dict.items():
+            if pub_id not in chebi_dict:
+                chebi_dict[pub_id] = chebi_ids
+
+    return chebi_dict
+
+def search_budget(args):
+    '''
+    This function returns the number of connections that the search pages of 'args.parallel' queries at once take from the connection budget of -q.
+    '''
+    return args.parallel * args.shards if args.shard_size else args.parallel
+
+async def harvest_queries(queries, pageSize, args, cache=None):
+    '''
+    This function harvests several queries at the same time, at most 'args.parallel' at once, all within one budget of 'args.connections' connections.
+    Every running query uses one of these connections for its search pages (or 'args.shards' with --shard-size), the others are shared by the annotation downloads of all queries.
+    The results and metadata of a query are written as soon as that query is finished, in a thread so that the other queries go on. A query that fails does not stop the others.
+    It returns the list of query terms that failed.
+    '''
+    search_connections = search_budget(args)
+    annotation_connections = args.connections - search_connections
+
+    loop = asyncio.get_running_loop()
+    # one more thread per query, to write its results while the other queries go on (see 'finish_term')
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=annotation_connections+search_connections+args.parallel))
+    semaphore = asyncio.Semaphore(annotation_connections)
+    limiter = AdaptiveLimiter(annotation_connections)
+    running = asyncio.Semaphore(args.parallel)
+    failed = []
+
+    async def harvest_term(term, query):
+        async with running:
+            try:
+                search, checkpoint, writer, stats, sampler = await prepare_term(term, query, args)
+            except DownloadError as error:
+                print('Error: %s\nthe hits of %s could not be counted, run it again' % (error, term))
+                failed.append(term)
+                return
+            try:
+                if args.shard_size:
+                    chebi_dict = await harvest_shards(search, pageSize, annotation_connections, args.shard_size, args.shards, args.batch_size, cache, semaphore, limiter, stats, sampler)
+                else:
+                    chebi_dict = await harvest_publications(search, pageSize, annotation_connections, args.batch_size, checkpoint, cache, writer, semaphore, limiter, stats, sampler)
+            except DownloadError as error:
+                stats.write_report(term, search)
+                print(failure_message(error, term, checkpoint))
+                failed.append(term)
+                return
+            await loop.run_in_executor(None, finish_term, term, query, search, chebi_dict, checkpoint, writer, stats, sampler)
+
+    await asyncio.gather(*(harvest_term(term, query) for term, query in queries.items()))
+
+    return failed
+
+async def prepare_term(term, query, args):
+    '''
+    This function prepares the search for one query term, and returns the query to search with, the checkpoint journal, the results writer (or None), the harvest stats
+    and the sampler (or None).
+    For a refresh, the query is restricted to the publications indexed since the previous search (see 'restrict_query').
+    For a sampling harvest, the sampling fraction is the sample size (given, or worked out from the error bound) divided by the number of publications with text mined terms.
+    The hits are counted with 'count_hits', so that the other queries of 'harvest_queries' go on in the meantime.
+    '''
+    # For a refresh, only search the publications indexed since the previous search with the same query
+    search = query
+    if args.refresh:
+        metadata = read_metadata(term)
+        if 'sampling fraction' in metadata:
+            print('the previous search of %s was a sample, searching all publications' % term)
+        elif metadata.get('query') == query and os.path.isfile('results/'+str(term)+'_ChEBI_IDs.tsv'):
+            # a refresh that is continued on a later day keeps the end date of its checkpoint journal
+            end_date = None
+            if args.resume and os.path.isfile(checkpoint_file(term)):
+                end_date = refresh_end_date(checkpoint_query(checkpoint_file(term)))
+            search = restrict_query(query, metadata['search date'], end_date)
+        else:
+            print('no previous search with this query found for %s, searching all publications' % term)
+
+    # Let Europe PMC select the publications with text mined terms, and record how many hits that saves
+    stats = HarvestStats()
+    if args.filter_tmt:
+        unfiltered = search
+        search = filter_query(search)
+        # one after the other, so that a query keeps to its one search connection
+        stats.filter(TMT_FILTER, await count_hits(unfiltered), await count_hits(search))
+    print('searching with: %s' % search)
+
+    # Only annotate a sample of the publications
+    sampler = None
+    if args.sample_size or args.sample_error:
+        population = await count_hits(filter_query(search))
+        target = args.sample_size if args.sample_size else sample_size_for_error(args.sample_error, population)
+        fraction = min(1.0, target / population) if population > 0 else 1.0
+        sampler = Sampler(fraction, args.sample_method, args.seed)
+        stats.sample(sampler, population, target)
+        print('sampling %d of %d publications with text mined terms (%s, fraction %.4g)' % (min(target, population), population, args.sample_method, fraction))
+
+    # A sharded search walks several cursor chains at once, which a checkpoint journal cannot follow (see 'main')
+    if args.shard_size:
+        return search, None, None, stats, sampler
+
+    # Stream the results to the results file (a refresh is merged at the end instead)
+    refresh = is_refresh(query, search)
+    stream = args.stream and not refresh
+
+    # Continue from the checkpoint journal if asked for, otherwise start a new one
+    checkpoint = checkpoint_file(term)
+    resume = args.resume and os.path.isfile(checkpoint)
+    if resume:
+        if checkpoint_query(checkpoint) != search:
+            sys.exit('Error: the checkpoint of %s was made for another query, remove %s to start over' % (term, checkpoint))
+    else:
+        start_checkpoint(checkpoint, search, stream)
+
+    # The journal of a streaming search only holds offsets in the results file, so it can only be continued by streaming, and the other way around
+    writer = None
+    offset = checkpoint_offset(checkpoint) if resume and not refresh else None
+    if offset != None:
+        if not args.stream:
+            print('%s was searched with -s, the search continues with -s' % term)
+        writer = ResultsWriter(term, query, offset)
+    elif resume:
+        if stream:
+            print('%s was searched without -s, the search continues without -s' % term)
+    elif stream:
+        writer = ResultsWriter(term, query)
+
+    return search, checkpoint, writer, stats, sampler
+
+def finish_term(term, query, search, chebi_dict, checkpoint, writer, stats, sampler=None):
+    '''
+    This function writes the results, metadata and harvest report (see harvest_stats.py) of a finished query term, and removes its checkpoint journal.
+    The results file is also written in the compact format (see compact_results.py), which make_table reads much faster.
+    For a sampling harvest, the sampling fraction is added to the metadata, so that make_table can scale the counts.
+    '''
+    if writer != None:
+        # a checkpoint journal made without streaming still holds its pages in the dictionary
+        writer.write_page(chebi_dict)
+        writer.close()
+        number_of_papers = writer.papers
+    elif is_refresh(query, search):
+        merge_results(chebi_dict, term, query, refresh_end_date(search))
+        number_of_papers = len(chebi_dict.keys())
+    else:
+        write_results(chebi_dict, term, query)
+        number_of_papers = len(chebi_dict.keys())
+    if sampler != None:
+        write_sampling(term, sampler)
+    write_compact('results/'+str(term)+'_ChEBI_IDs.tsv')
+    stats.write_report(term, search)
+    if checkpoint != None:
+        os.remove(checkpoint)
+    if stats.offline != None:
+        print(cache_report(stats.cache_hits, stats.cache_misses, stats.offline))
+    print('%d publications with text mined terms and annotations of type \'chemical\' found for %s' % (number_of_papers, term) )
+    print('harvest report of %s written to metadata/%s.json (%s)' % (term, term, stats.progress()))
+
+def failure_message(error, term, checkpoint):
+    """
+    This function returns the message for a search that stopped with a download error, which tells how to continue it.
+    """
+
+    if checkpoint == None:
+        return 'Error: %s\nthe sharded search of %s cannot be continued, run it again (the earlier results file is left as it was)' % (error, term)
+    return 'Error: %s\nthe finished pages of %s are kept in %s, run again with --resume to continue' % (error, term, checkpoint)
+
 def write_results(dict, term, query):
     """
     This function writes the ChEBI urls and publication ID's in a seperate csv file and the metadata to a text file.
@@ -165,20 +851,134 @@ def write_results(dict, term, query):
 
     print('%s query results are written to file' % term)
 
-    # Get metadata
-    current_day = datetime.date.today()
-    number_of_papers = len(dict.keys())
-    number_of_chemicals = count
-    number_of_unique_chemicals = len(uniques)
-
-    file = 'metadata/'+str(term)+'.txt'
-    f = open(file, 'w')
-    f.write('metadata for %s\n' % term
-    + 'query: %s\n' % query
-    + 'search date: %s\n' % current_day
-    + 'number of papers: %d\n' % number_of_papers
-    + 'number of chemicals: %d\n' % number_of_chemicals
-    + 'number of unique chemicals: %d (note: not all chemicals can be plotted due to missing logP values)' % number_of_unique_chemicals )
+    write_metadata(term, query, len(dict.keys()), count, len(uniques))
+
+class ResultsWriter:
+    """
+    This class writes the ChEBI ID's and publication ID's to the results file page by page, while the search is still running.
+    The metadata counts are kept up to date along the way, so only the set of unique ChEBI ID's is kept in memory, not the search results.
+    """
+
+    def __init__(self, term, query, offset=None):
+        """
+        This function opens the results file of the term. Without an offset a new results file is started.
+        With an offset (from the checkpoint journal), the rows after the offset are cut off and the counts are read from the remaining rows, so that the search can continue.
+        """
+
+        self.term = term
+        self.query = query
+        self.file = 'results/'+str(term)+'_ChEBI_IDs.tsv'
+        self.count = 0
+        self.uniques = set()
+        self.papers = 0
+
+        if offset == None:
+            self.tsvfile = open(self.file, 'w', newline='', encoding="utf-8")
+        else:
+            with open(self.file, 'r+b') as f:
+                f.truncate(offset)
+            self.read_counts()
+            self.tsvfile = open(self.file, 'a', newline='', encoding="utf-8")
+        self.writer = csv.writer(self.tsvfile, delimiter = '\t')
+
+    def read_counts(self):
+        """
+        This function counts the rows, unique ChEBI ID's and publications that are already in the results file.
+        Rows of one publication are written together, so a new publication starts where the publication ID changes.
+        """
+
+        previous = None
+        with open(self.file, 'r', newline='', encoding="utf-8") as tsvfile:
+            for chebi_id, pub_id in csv.reader(tsvfile, delimiter = '\t'):
+                self.count += 1
+                self.uniques.add(chebi_id)
+                if pub_id != previous:
+                    self.papers += 1
+                    previous = pub_id
+
+    def write_page(self, page_dict):
+        """
+        This function writes the ChEBI ID's of one page to the results file, and returns the size of the results file after the page.
+        """
+
+        for pub_id in page_dict.keys():
+            for chebi_id in page_dict[pub_id]:
+                self.count += 1
+                self.uniques.add(chebi_id)
+                self.writer.writerow([chebi_id, pub_id])
+        self.papers += len(page_dict.keys())
+        self.tsvfile.flush()
+
+        return self.tsvfile.tell()
+
+    def close(self):
+        """
+        This function closes the results file and writes the metadata.
+        """
+
+        self.tsvfile.close()
+        print('%s query results are written to file' % self.term)
+        write_metadata(self.term, self.query, self.papers, self.count, len(self.uniques))
+
+def merge_results(dict, term, query, search_date=None):
+    """
+    This function merges the ChEBI ID's of a refresh search into the existing results file of the term.
+    Rows of publications that were found again are replaced by their new rows, the new publications are added at the end.
+    The metadata is written again with the counts of the merged results file, and the end date of the refresh as search date.
+    """
+
+    file = 'results/'+str(term)+'_ChEBI_IDs.tsv'
+    count = 0
+    uniques = set()
+    papers = set()
+
+    with open(file, 'r', newline='', encoding="utf-8") as tsvfile:
+        rows = [row for row in csv.reader(tsvfile, delimiter = '\t') if row[1] not in dict]
+
+    with open(file, 'w', newline='', encoding="utf-8") as tsvfile:
+        writer = csv.writer(tsvfile, delimiter = '\t')
+        rows.extend([chebi_id, pub_id] for pub_id in dict.keys() for chebi_id in dict[pub_id])
+        for chebi_id, pub_id in rows:
+            count += 1
+            uniques.add(chebi_id)
+            papers.add(pub_id)
+            writer.writerow([chebi_id, pub_id])
+
+    print('%s refresh results are merged into the results file' % term)
+
+    write_metadata(term, query, len(papers), count, len(uniques), search_date)
+
+def filter_query(query):
+    """
+    This function restricts the query to publications with text mined terms, so that Europe PMC leaves out the other publications instead of the harvester.
+    """
+
+    return '(' + query + ') AND (' + TMT_FILTER + ')'
+
+def is_refresh(query, search):
+    """
+    This function tells whether the search is a refresh of the query (restricted to recently indexed publications) rather than a full search, with or without the text mined terms filter.
+    """
+
+    return search not in (query, filter_query(query))
+
+def restrict_query(query, search_date, end_date=None):
+    """
+    This function restricts the query to publications that were first indexed by europe pmc since the search date (and up to today, or the end date if given).
+    The search date itself is included, so no publication indexed on the day of the previous search is missed.
+    """
+
+    current_day = datetime.date.today() if end_date == None else end_date
+
+    return '(' + query + ') AND (FIRST_IDATE:[' + str(search_date) + ' TO ' + str(current_day) + '])'
+
+def refresh_end_date(search):
+    """
+    This function returns the end date of a refresh query (see 'restrict_query'), or None if the query is not restricted to recently indexed publications.
+    """
+
+    dates = re.findall(r'FIRST_IDATE:\[\S+ TO (\S+)\]', search)
+    return dates[-1] if dates else None
 
 def read_input(file):
     '''
@@ -203,6 +1003,25 @@ def parser():
     parser = argparse.ArgumentParser(description='A script that parses JSON data from EPC publications and extracts annotations of type Chemicals')
     parser.add_argument('-i', required=True, metavar='input_file', dest='input_file', help='[i] to select input file from the queries folder')
     parser.add_argument('-p', required=False, metavar='pageSize', dest='pageSize', help='[p] to select pageSize, not required, defeault=1000')
+    parser.add_argument('-a', default=False, action='store_true', dest='asynchronous', help='[a] to download the next search page while the annotations of earlier pages are downloading')
+    parser.add_argument('-c', required=False, type=int, default=10, metavar='connections', dest='connections', help='[c] to select the maximum number of annotation connections with -a, next to the search connection (or --shards connections with --shard-size) (with -q: the total number of connections of all queries, search connections included), default=10')
+    parser.add_argument('-q', required=False, type=int, default=1, metavar='parallel', dest='parallel', help='[q] to select the number of queries that are searched at the same time (implies -a), default=1')
+    parser.add_argument('-b', required=False, type=int, default=1, metavar='batch_size', dest='batch_size', help='[b] to select the number of publications per annotation request, default=1')
+    parser.add_argument('--shard-size', required=False, type=int, metavar='shard_size', dest='shard_size', help='[shard-size] to divide the search in publication date ranges of at most this many hits, which are searched at the same time (implies -a, not used with -s or --resume)')
+    parser.add_argument('--shards', required=False, type=int, default=4, metavar='shards', dest='shards', help='[shards] to select the number of date ranges that are searched at the same time with --shard-size, default=4')
+    parser.add_argument('-w', required=False, type=int, default=0, metavar='workers', dest='workers', help='[w] to parse the annotation downloads in this many processes, for fast connections on a machine with several cores, default=0 (parse in the download threads)')
+    parser.add_argument('-f', '--filter-tm', default=False, action='store_true', dest='filter_tmt', help='[f] to let Europe PMC select the publications with text mined terms (HAS_TM:Y) and download only their ID\'s (idlist), which makes the search pages much smaller')
+    parser.add_argument('--sample-size', required=False, type=int, metavar='sample_size', dest='sample_size', help='[sample-size] to only annotate a sample of about this many publications with text mined terms, for a quick look at a query (not used with --refresh)')
+    parser.add_argument('--sample-error', required=False, type=float, metavar='error', dest='sample_error', help='[sample-error] to only annotate a sample that is large enough to estimate the share of publications in any part of the plot within this error (e.g. 0.01) with 95%% confidence')
+    parser.add_argument('--sample-method', required=False, default='random', choices=SAMPLING_METHODS, metavar='method', dest='sample_method', help='[sample-method] to select the publications of the sample at random or stratified over the search pages, default=random')
+    parser.add_argument('--seed', required=False, type=int, default=0, metavar='seed', dest='seed', help='[seed] to select another sample with the same size, default=0')
+    parser.add_argument('-r', '--resume', default=False, action='store_true', dest='resume', help='[r] to continue an interrupted search from its checkpoint in the checkpoints folder')
+    parser.add_argument('-u', '--refresh', default=False, action='store_true', dest='refresh', help='[u] to only search publications indexed since the search date in the metadata, and merge them into the existing results')
+    parser.add_argument('-s', '--stream', default=False, action='store_true', dest='stream', help='[s] to write the results file page by page during the search instead of at the end (not used with --refresh)')
+    parser.add_argument('--cache', required=False, nargs='?', const='cache/annotations.sqlite', metavar='cache_file', dest='cache_file', help='[cache] to keep downloaded annotations in a cache file that is shared by all queries, default=cache/annotations.sqlite')
+    parser.add_argument('--store', required=False, metavar='store_file', dest='store_file', help='[store] to take the annotations from an annotation store made by ingest_annotations.py instead of the annotations api (publications that are not in the store count as without chemicals)')
+    parser.add_argument('--cache-days', required=False, type=float, metavar='max_age', dest='cache_days', help='[cache-days] to remove cached annotations that are older than this number of days')
+    parser.add_argument('--cache-size', required=False, type=int, metavar='max_entries', dest='cache_size', help='[cache-size] to keep at most this number of publications in the cache (least recently used are removed)')
     arguments = parser.parse_args()
     return arguments
 
@@ -212,13 +1031,60 @@ def main():
     #pageSize = int(args.pageSize)
     pageSize = 1000
 
+    # Keep enough connections open for all simultaneous downloads
+    http_client.get_session(args.connections + args.parallel * args.shards)
+    if args.workers > 0:
+        start_parse_pool(args.workers)
+
+    cache = None
+    if args.cache_file and args.store_file:
+        sys.exit('Error: please give either --cache or --store')
+    if args.cache_file:
+        cache = AnnotationCache(args.cache_file, args.cache_days, args.cache_size)
+    if args.store_file:
+        if not os.path.isfile(args.store_file):
+            sys.exit('Error: annotation store %s not found, make it with ingest_annotations.py' % args.store_file)
+        cache = AnnotationCache(args.store_file, offline=True)
+
+    if args.shard_size and (args.stream or args.resume):
+        sys.exit('Error: a sharded search (--shard-size) cannot be streamed (-s) or continued (--resume), please leave these out')
+    if args.parallel > 1 and args.connections <= search_budget(args):
+        sys.exit('Error: -c %d leaves no annotation connections next to the %d search connections of -q %d, please raise -c' % (args.connections, search_budget(args), args.parallel))
+    if (args.sample_size or args.sample_error) and args.refresh:
+        sys.exit('Error: a sample cannot be merged into earlier results, please leave out --refresh')
+
     queries = read_input(input_file)
+
+    # Search several queries at the same time
+    if args.parallel > 1:
+        failed = asyncio.run(harvest_queries(queries, pageSize, args, cache))
+        if cache != None:
+            print('%s (all queries)' % cache.report())
+        print(http_client.stats_report())
+        if len(failed) > 0:
+            sys.exit('Error: the search failed for %s' % ', '.join(failed))
+        return
+
     for term in queries.keys():
         query = queries[term]
-        print('searching with: %s' % query)
-        chebi_dict = search_publications(query, pageSize)
-        write_results(chebi_dict, term, query)
-        print('%d publications with text mined terms and annotations of type \'chemical\' found for %s' % (len(chebi_dict.keys()), term) )
+        try:
+            search, checkpoint, writer, stats, sampler = asyncio.run(prepare_term(term, query, args))
+        except DownloadError as error:
+            sys.exit('Error: %s\nthe hits of %s could not be counted, run it again' % (error, term))
+
+        try:
+            if args.shard_size:
+                chebi_dict = asyncio.run(harvest_shards(search, pageSize, args.connections, args.shard_size, args.shards, args.batch_size, cache, stats=stats, sampler=sampler))
+            elif args.asynchronous:
+                chebi_dict = asyncio.run(harvest_publications(search, pageSize, args.connections, args.batch_size, checkpoint, cache, writer, stats=stats, sampler=sampler))
+            else:
+                chebi_dict = search_publications(search, pageSize, args.batch_size, checkpoint, cache, writer, stats, sampler)
+        except DownloadError as error:
+            stats.write_report(term, search)
+            sys.exit(failure_message(error, term, checkpoint))
+        finish_term(term, query, search, chebi_dict, checkpoint, writer, stats, sampler)
+
+    print(http_client.stats_report())
 
 if __name__ == '__main__':
     main()
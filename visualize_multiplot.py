@@ -7,6 +7,7 @@ from math import exp
 from math import sqrt
 from datetime import datetime
 import os
+from class_index import ClassIndex
 
 # BOKEH
 from bokeh import events
@@ -96,6 +97,18 @@ def add_tooltip_columns(df, table):
 
     return df
 
+def add_count_error(df, error):
+    '''
+    This function adds the "Count_error" column that the tooltip shows after the total count: "± <standard error>" for the hexagons of a sample,
+    and nothing for a full search. Hexagons that only have counts from the blur of their neighbours have no standard error of their own.
+    '''
+    if error is None:
+        df.loc[:,"Count_error"] = ''
+        return df
+    df = df.merge(error, on=['q', 'r'], how='left')
+    df.loc[:,"Count_error"] = ['± %d' % round(se) if se == se else '' for se in df.Count_se]
+    return df.drop(columns='Count_se')
+
 def get_blur(x,y,sigma_x,sigma_y):
     '''
     This function recieves x, y values and sigma x, sigma y values and returns the calculated blur value.
@@ -179,18 +192,18 @@ def add_gaussian_blur(df, blur_max, step_size):
 
     return df_joined
 
-def check_for_ids(id_list, class_id):
+def make_class_index(tables):
     '''
-    This functions checks if the Class identifier is in the "id_list".
-    This ChEBI ID-specific list contains other ChEBI identifers of chemicals that are of higher level hierarchical class.
+    This function builds one class index (see class_index.py) from the Class lists of all tables. Every list holds the ChEBI identifiers of the higher level
+    classes of a chemical, and the index adds the classes of those classes, as far as they are chemicals in one of the tables.
     '''
-    # check = any(class_id == id for id in id_list)
-    check = any(str(class_id) == str(id) for id in id_list)
-    return check
+    classes = pd.concat([tables[term]['table']['Class'] for term in tables.keys()])
+    classes = classes[~classes.index.duplicated(keep='last')]
+    return ClassIndex.from_lists(classes.index.to_numpy(), [[int(id) for id in id_list] for id_list in classes])
 
-def create_class_source(table, size, ratio, orientation, class_id):
+def create_class_source(table, size, ratio, orientation, class_id, class_index=None):
     '''
-    This function finds all chemicals belonging to class "class_id" as defined by the ChEBI ontology.
+    This function finds all chemicals belonging to class "class_id" as defined by the ChEBI ontology, with a bitmap of the class from the class index.
     It returns a dataframe filtered for these chemicals.
     '''
     if class_id == None:
@@ -198,7 +211,9 @@ def create_class_source(table, size, ratio, orientation, class_id):
         df = pd.DataFrame().reindex_like(table)
 
     else:
-        table_class_only = table[[check_for_ids(id_list, class_id) for id_list in table["Class"]]]
+        if class_index == None:
+            class_index = ClassIndex.from_lists(table.index.to_numpy(), [[int(id) for id in id_list] for id_list in table["Class"]])
+        table_class_only = table[class_index.in_class(table.index.to_numpy(), int(class_id))]
 
         # create array
         x, y = create_array(table_class_only)
@@ -231,6 +246,11 @@ def create_data_source(table, term, size, ratio, orientation, BLUR_MAX, BLUR_STE
     df.loc[:,"q"] = q
     df.loc[:,"r"] = r
 
+    # the table of a sample (see make_table.scale_sample) has the variance of every count, which is added up per hexagon for its standard error
+    error = None
+    if 'CountVar' in df.columns:
+        error = np.sqrt(df.groupby(['q', 'r'])['CountVar'].sum()).rename('Count_se').reset_index()
+
     # sum rows with identical coordinates together, add blur, and add tooltip information
     df = df.groupby(['q', 'r']).agg({'Count': 'sum', 'TFIDF': 'sum', 'ChEBI': list}).reset_index()
 
@@ -238,6 +258,7 @@ def create_data_source(table, term, size, ratio, orientation, BLUR_MAX, BLUR_STE
     df = add_tooltip_columns(df, table)
     df = df.drop(columns='ChEBI')
     df.loc[:,"Count_total"] = df.loc[:,"Count"]
+    df = add_count_error(df, error)
 
     # plot title and source
     title = 'Hexbin plot for '+str(len(x))+' annotated chemicals with query '+str(term)
@@ -415,7 +436,7 @@ def return_JS_code(widget):
               <col width="305">
               <tr>
                 <th>Total Counts</th>
-                <th>@Count_total</th>
+                <th>@Count_total @Count_error</th>
                 <th>@TFIDF</th>
                 <th>($x, $y)</th>
               </tr>
@@ -606,13 +627,9 @@ def return_html(metadata):
     <BODY BGCOLOR="FFFFFF">
     %s
     <br>%s
-    <br>%s
-    <br>%s
-    <br>%s
-    <br>%s
     </BODY>
     </HTML>
-    """ % (metadata[0], metadata[0], metadata[1], metadata[2], metadata[3], metadata[4], metadata[5])
+    """ % (metadata[0], metadata[0], '\n    <br>'.join(metadata[1:]))
     return html_content
 
 def plot(tables, output_filename, xmin, xmax, ymin, ymax, class_id):
@@ -667,6 +684,9 @@ def plot(tables, output_filename, xmin, xmax, ymin, ymax, class_id):
     term_to_stats = dict()
 
     options = []
+    # class index for the class sources of all tables
+    class_index = make_class_index(tables) if class_id else None
+
     # Loop for plot sources
     for term in tables.keys():
         print('sourcing %s' % term)
@@ -679,7 +699,7 @@ def plot(tables, output_filename, xmin, xmax, ymin, ymax, class_id):
 
         # plot sources
         source, title = create_data_source(table, term, size, ratio, orientation, BLUR_MAX, BLUR_STEP_SIZE)
-        source_class = create_class_source(table, size, ratio, orientation, class_id)
+        source_class = create_class_source(table, size, ratio, orientation, class_id, class_index)
         stats_description = create_stats_description(table)
         term_to_source[term] = {'source': source, 'title': title}
         term_to_class[term] =  {'source': source_class, 'show_class': True}
@@ -703,7 +723,7 @@ def plot(tables, output_filename, xmin, xmax, ymin, ymax, class_id):
            fill_color=mapper)
 
     if class_id:
-        source_class = create_class_source(table, size, ratio, orientation, class_id)
+        source_class = create_class_source(table, size, ratio, orientation, class_id, class_index)
         class_hex = p.hex_tile(q='q', r="r", size=size, line_color=None, source=source_class, aspect_scale=ratio,orientation=orientation,
             fill_color='#ff007f')
         class_hex.visible = False
@@ -779,7 +799,8 @@ def get_tables(files):
     for file in files:
         table = import_table(file)
         term = file.split('/')[1].split('_table')[0]
-        metadata_file = 'metadata/'+str(term)+'.txt'
+        # tables of one class (make_table.py -c) share the metadata of their term
+        metadata_file = 'metadata/'+str(term).split('_class')[0]+'.txt'
         metadata_lines = open(metadata_file, 'r')
         metadata = metadata_lines.readlines()
 